@@ -2,32 +2,107 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import asyncio
 import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
+from deferred import DeferredEntries, deferred_path
 from github import gh
+from index import ProcessedIndex, index_path
+from journal import Journal
 from loguru import logger
-from podcast import generate_pod_header, generate_pod_item
-from utils import load_xml, save_xml
-from videogram.utils import load_json, save_json
-from videogram.videogram import download, sync
+from metrics import metrics
+from podcast import generate_pod_header, generate_pod_items
+from store import open_store
+from utils import CACHE_DIR, delete_files, splice_xml
+
+INDEX_LOCK = threading.Lock()
+
+
+def select_feeds(configs: list[dict], names: list[str]) -> list[dict]:
+    """Select feed configurations by name.
+
+    Args:
+        configs (list[dict]): all feed configurations of a platform.
+        names (list[str]): feed names, each can also be a comma separated list. "all" selects every feed.
+
+    Returns:
+        list[dict]: selected configurations, in the order of names.
+    """
+    wanted = [x.strip() for name in names for x in name.split(",") if x.strip()]
+    if "all" in wanted:
+        return configs
+    by_name = {x["name"]: x for x in configs}
+    missing = [x for x in wanted if x not in by_name]
+    if missing:
+        raise ValueError(f"Unknown feeds: {', '.join(missing)}")
+    return [by_name[x] for x in dict.fromkeys(wanted)]
 
 
 class PodSync:
     """Base class for preprocessing."""
 
-    def __init__(self, name: str, config: dict, database_path: Path) -> None:
+    platform = ""  # name of the processed index, see `update_index`
+
+    def __init__(
+        self,
+        name: str,
+        config: dict,
+        database_path: Path,
+        *,
+        checkpoint_entries: int = 5,
+        checkpoint_seconds: float = 600,
+        keep_items: int | None = None,
+        download_workers: int = 2,
+        batch_threshold: int = 3,
+    ) -> None:
         """Initialize PodSync.
 
+        Changes of the database and RSS feeds are buffered in memory and uploaded together at checkpoints,
+        see `checkpoint` and `flush`. Buffered changes are also written to a local journal,
+        and unsaved changes of a killed run are replayed here.
+
         Args:
             name (str): feed name
             config (dict): sync configuration of this feed.
             database_path (Path): Path of the database, which  processed videos of this feed.
+            checkpoint_entries (int, optional): Flush after this number of processed entries. Defaults to 5.
+            checkpoint_seconds (float, optional): Flush if the last flush is older than this number of seconds. Defaults to 600.
+            keep_items (int | None, optional): Keep only the newest items in RSS feeds when writing them. Defaults to None, which means no limit.
+            download_workers (int, optional): Number of threads for blocking extraction and download work. Defaults to 2.
+            batch_threshold (int, optional): Prefetch video info in a batch if there are at least this number of new entries. Defaults to 3.
         """
         self.name = name
         self.config = config
         self.db_path = database_path
-        self.database: list[dict] = load_json(database_path.as_posix(), default=[])  # type: ignore
+        self.store = open_store(database_path)
+        self.deferred = DeferredEntries(deferred_path(database_path))
+        self.executor = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix=f"podsync-{name}")
+
+        self.checkpoint_entries = checkpoint_entries
+        self.checkpoint_seconds = checkpoint_seconds
+        self.keep_items = keep_items
+        self.batch_threshold = batch_threshold
+        self.journal = Journal(CACHE_DIR / "journal" / f"{name}.jsonl")
+        self.pending_items: dict[str, list[dict]] = {}  # pod_type -> new items, from the latest to the oldest
+        self.pending_feed: dict = {}
+        self.database_changed = False
+        self.db_name = "metadata"
+        self.entries_since_flush = 0
+        self.last_flush = time.monotonic()
+        self.recover()
+
+    def is_processed(self, vid: str) -> bool:
+        return vid in self.store
+
+    def is_deferred(self, vid: str) -> bool:
+        """Whether the entry is deferred and should not be checked again yet."""
+        return not self.deferred.is_due(vid)
 
     def check_entry(self, entry: dict) -> dict:
         """Check if the entry is valid for download.
@@ -42,6 +117,9 @@ class PodSync:
             - metadata: dict, metadata of the entry.
             - need_download: bool, whether the entry should be downloaded.
 
+        and optionally:
+            - defer: dict, the "reason" and optional "retry_at" datetime, if the entry should be checked again later.
+
         For example:
             - For a banned video, the need_update_database should be true because we need to treat it as processed.
               But the need_download should be false because we don't need to download it.
@@ -55,9 +133,22 @@ class PodSync:
         """
         raise NotImplementedError
 
+    def prefetch(self, entries: list[dict]) -> None:
+        """Fetch the info of many entries in a batch, so that `check_entry` does not need to extract them one by one.
+
+        This method can be implemented by the subclass. Results are put into the extraction cache,
+        and entries missing from the batch are still extracted by `check_entry`.
+
+        Args:
+            entries (list[dict]): entries from the feedparser.
+        """
+
     async def process_single_entry(self, entry: dict, *, use_cookie: bool = False) -> dict:
         """Process a single entry.
 
+        Blocking work, i.e. `check_entry` and downloading, runs in the thread pool executor,
+        so other entries can make progress at the same time.
+
         Args:
             entry (dict): A single entry information from the feedparser.
             use_cookie (bool, optional): Whether to use cookies for downloading. Defaults to False.
@@ -69,92 +160,313 @@ class PodSync:
             "entry_info": {},
             "download_info": {},
         }
-        checked_entry_result = self.check_entry(entry)
+        loop = asyncio.get_running_loop()
+        checked_entry_result = await loop.run_in_executor(self.executor, metrics.wrap("check_entry", self.name, self.check_entry), entry)
         res["entry_info"] = checked_entry_result
         if not checked_entry_result["need_update_database"]:
             return res
 
         if not checked_entry_result["need_download"]:
             return res
+
+        from videogram.videogram import download, sync
+
         try:
             if self.config.get("skip_telegram"):
+                stage = "download"
                 logger.info(f"Downloading: {entry['title']}")
-                download_info = download(entry["link"], split_video=True, use_cookie=use_cookie)
+                timed_download = metrics.wrap(stage, self.name, download)
+                download_info = await loop.run_in_executor(self.executor, partial(timed_download, entry["link"], split_video=True, use_cookie=use_cookie))
             else:
+                stage = "telegram_sync"
                 logger.info(f"Syncing to Telegram: {entry['title']}")
-                download_info = await sync(
-                    entry["link"],
-                    tg_id=self.config["tg_target"] if self.config.get("tg_target") else os.environ["DEFAULT_TG_TARGET"],
-                    sync_audio=not self.config.get("skip_audio", False),
-                    sync_video=not self.config.get("skip_video", False),
-                    use_cookie=use_cookie,
-                    clean=False,
-                )
+                with metrics.span(stage, self.name):
+                    download_info = await sync(
+                        entry["link"],
+                        tg_id=self.config["tg_target"] if self.config.get("tg_target") else os.environ["DEFAULT_TG_TARGET"],
+                        sync_audio=not self.config.get("skip_audio", False),
+                        sync_video=not self.config.get("skip_video", False),
+                        use_cookie=use_cookie,
+                        clean=False,
+                    )
         except Exception as e:  # noqa: BLE001
             logger.error(e)
             return res
+        if metrics.enabled:
+            self.count_downloads(stage, download_info)
         res["download_info"] = download_info
         return res
 
+    def count_downloads(self, stage: str, download_info: dict) -> None:
+        """Record the downloaded bytes of an entry, and the number of parts, which is more than one for split videos."""
+        for pod_type in ("audio", "video"):
+            paths = [Path(x[f"{pod_type}_path"]) for x in download_info.get(f"{pod_type}_info") or []]
+            size = sum(x.stat().st_size for x in paths if x.exists())
+            metrics.count(stage, self.name, **{f"{pod_type}_bytes": size, f"{pod_type}_parts": len(paths)})
+
+    async def run_pipeline(
+        self,
+        entries: list[dict],
+        feed: dict,
+        *,
+        use_cookie: bool = False,
+        download_concurrency: int = 1,
+        upload_concurrency: int = 1,
+        queue_size: int = 2,
+        min_free_space: int = 0,
+    ) -> None:
+        """Download, upload and publish entries in a pipeline.
+
+        Each stage has its own workers, so the next entry is downloading while the previous one is uploading.
+        Downloaded entries wait in a bounded queue for the uploaders, and a new download only starts when
+        there is enough free disk space, unless no downloaded files are waiting, because then nothing can free space.
+        Entries are published from the oldest to the latest, whatever order the uploads finish in.
+
+        Args:
+            entries (list[dict]): entries from the feedparser, from the oldest to the latest.
+            feed (dict): feed information from the feedparser, used for the RSS header.
+            use_cookie (bool, optional): Whether to use cookies for downloading. Defaults to False.
+            download_concurrency (int, optional): Maximum number of entries downloaded at the same time. Defaults to 1.
+            upload_concurrency (int, optional): Maximum number of entries uploaded at the same time. Defaults to 1.
+            queue_size (int, optional): Maximum number of downloaded entries waiting for upload. Defaults to 2.
+            min_free_space (int, optional): Minimum free disk space in bytes to start a download. Defaults to 0.
+        """
+        loop = asyncio.get_running_loop()
+        if len(entries) >= self.batch_threshold:
+            try:
+                await loop.run_in_executor(self.executor, metrics.wrap("prefetch", self.name, self.prefetch), entries)
+            except Exception as e:  # noqa: BLE001
+                logger.warning(f"Failed to prefetch {len(entries)} entries, fall back to single extraction: {e}")
+
+        todo: asyncio.Queue[int] = asyncio.Queue()
+        for idx in range(len(entries)):
+            todo.put_nowait(idx)
+        uploads: asyncio.Queue[tuple[int, dict]] = asyncio.Queue(maxsize=queue_size)
+        published = [loop.create_future() for _ in entries]
+        disk = asyncio.Condition()
+        on_disk = 0  # number of downloaded entries whose files are not deleted yet
+
+        def has_free_space() -> bool:
+            return on_disk == 0 or shutil.disk_usage(".").free >= min_free_space
+
+        async def download_worker() -> None:
+            nonlocal on_disk
+            while not todo.empty():
+                idx = todo.get_nowait()
+                async with disk:
+                    if not has_free_space():
+                        logger.info(f"Waiting for free disk space: {entries[idx]['title']}")
+                    await disk.wait_for(has_free_space)
+                    on_disk += 1
+                try:
+                    res = await self.process_single_entry(entries[idx], use_cookie=use_cookie)
+                except Exception as e:  # noqa: BLE001
+                    published[idx].set_exception(e)
+                    res = None
+                if res is None or not res["download_info"]:
+                    async with disk:
+                        on_disk -= 1
+                        disk.notify_all()
+                    if res is not None:
+                        published[idx].set_result((res, {}))
+                    continue
+                await uploads.put((idx, res))
+
+        async def upload_worker() -> None:
+            nonlocal on_disk
+            while True:
+                idx, res = await uploads.get()
+                try:
+                    media = await asyncio.to_thread(self.upload_entry, entries[idx], res)
+                except Exception as e:  # noqa: BLE001
+                    published[idx].set_exception(e)
+                else:
+                    published[idx].set_result((res, media))
+                finally:
+                    async with disk:
+                        on_disk -= 1
+                        disk.notify_all()
+                    uploads.task_done()
+
+        workers = [asyncio.create_task(download_worker()) for _ in range(download_concurrency)]
+        workers += [asyncio.create_task(upload_worker()) for _ in range(upload_concurrency)]
+        try:
+            for entry, future in zip(entries, published, strict=True):
+                res, media = await future
+                await asyncio.to_thread(self.publish_entry, entry, res, media, feed)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def get_vid(self, entry: dict) -> str:
+        raise NotImplementedError
+
+    def get_cover(self, entry: dict) -> str:
+        return self.config.get("cover", "")
+
+    def cleanup_entry(self, entry: dict) -> None:
+        """Delete the downloaded files of an entry."""
+        prefix = entry["title"][:60]
+        delete_files(Path(".").glob(f"{prefix}.*"))
+
+    def upload_entry(self, entry: dict, res: dict) -> dict[str, list[dict]]:
+        """Upload the downloaded files of an entry.
+
+        Returns:
+            dict[str, list[dict]]: uploaded media files of each pod type, see `upload_files`.
+        """
+        vid = self.get_vid(entry)
+        media = {}
+        for pod_type in ("audio", "video"):
+            if self.config.get(f"skip_{pod_type}", False):
+                continue
+            media[pod_type] = self.upload_files(pod_type, res["download_info"][f"{pod_type}_info"], vid)
+        self.cleanup_entry(entry)
+        return media
+
+    def publish_entry(self, entry: dict, res: dict, media: dict[str, list[dict]], feed: dict) -> None:
+        """Buffer the database and RSS changes of an entry, and flush if the checkpoint is reached.
+
+        Everything needed to generate the podcast items again is recorded in the metadata, see `rebuild.py`.
+        """
+        vid = self.get_vid(entry)
+        if res["entry_info"].get("defer"):
+            self.deferred.defer(vid, **res["entry_info"]["defer"])
+        elif res["entry_info"]["need_update_database"]:
+            self.deferred.resolve(vid)
+        cover = self.get_cover(entry)
+        if res["entry_info"]["need_update_database"]:
+            res["entry_info"]["metadata"].update({"link": entry["link"], "summary": entry.get("summary", ""), "cover": cover, "media": media})
+        self.update_database(res["entry_info"])
+        for pod_type, files in media.items():
+            self.update_pod_rss(pod_type, self.get_pod_items(pod_type, files, entry, cover), feed=feed)
+        self.checkpoint()
+
     def update_database(self, checked_info: dict, db_name: str = "metadata") -> None:
         """Update the database with the checked entry information.
 
+        The database file is saved and uploaded at the next flush.
+
         Args:
             checked_info (dict): The checked entry information.
             db_name (str, optional): Database name. Defaults to "metadata".
         """
+        self.db_name = db_name
         if checked_info["need_update_database"]:
-            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
-            self.database.insert(0, checked_info["metadata"])
-            save_json(self.database, self.db_path)
-            gh.upload_release(self.db_path, db_name)
+            self.journal.append({"type": "database", "record": checked_info["metadata"]})
+            self._buffer_database(checked_info["metadata"])
+
+    def upload_files(self, file_type: str, info_list: list[dict], vid: str) -> list[dict]:
+        """Rename downloaded files after the vid, upload them to the release of this feed, and delete them.
 
-    def upload_files(self, file_type: str, info_list: list[dict], vid: str) -> list[Path]:
+        Returns:
+            list[dict]: uploaded media files, each has "part", "asset", "size" and "duration".
+        """
         if len(info_list) == 0:
             return []
         assert file_type in {"audio", "video"}
         upload_files = []
+        media = []
         for idx, info in enumerate(info_list):
             filepath = Path(info[f"{file_type}_path"])
             new_path = filepath.with_stem(f"{vid}-P{idx+1}") if idx > 0 else filepath.with_stem(vid)
             logger.info(f"Upload {filepath.name} to GitHub with new name: {new_path.name}")
             logger.debug(f"Rename {filepath.name} to {new_path.name}")
             filepath.rename(new_path)
-            gh.upload_release(new_path.as_posix(), self.name, clean=False)
             upload_files.append(new_path)
-        return upload_files
+            media.append({"part": idx + 1, "asset": new_path.name, "size": new_path.stat().st_size, "duration": info["duration"]})
+        with metrics.span("upload_files", self.name) as span:
+            gh.upload_assets(upload_files, self.name, clean=False)
+            span.add(files=len(media), bytes=sum(x["size"] for x in media))
+        delete_files(upload_files)
+        return media
 
-    def get_pod_items(self, pod_type: str, info_list: list[dict], vid: str, entry: dict, cover: str) -> list[dict]:
-        if len(info_list) == 0:
-            return []
+    def get_pod_items(self, pod_type: str, media: list[dict], entry: dict, cover: str) -> list[dict]:
         assert pod_type in {"audio", "video"}
-        pod_items = []
-        for idx, info in enumerate(info_list):
-            original_filepath = Path(info[f"{pod_type}_path"])
-            real_path = original_filepath.with_stem(f"{vid}-P{idx+1}") if idx > 0 else original_filepath.with_stem(vid)
-            pod_item = generate_pod_item(
-                entry,
-                pod_type=pod_type,
-                release_name=self.name,
-                filepath=real_path,
-                cover=cover,
-                duration=info["duration"],
-            )
-            real_path.unlink(missing_ok=True)
-            pod_items.append(pod_item)
-        return pod_items
+        return generate_pod_items(entry, pod_type=pod_type, release_name=self.name, media=media, cover=cover)
 
     def update_pod_rss(self, pod_type: str, pod_items: list[dict], feed: dict) -> None:
+        """Add new items to the RSS feed. The RSS file is saved and uploaded at the next flush."""
         if len(pod_items) == 0:
             return
         assert pod_type in {"audio", "video"}
+        with metrics.span("update_pod_rss", self.name) as span:
+            self.journal.append({"type": "rss", "pod_type": pod_type, "items": pod_items, "feed": feed})
+            self._buffer_rss(pod_type, pod_items, feed)
+            span.add(items=len(pod_items))
+
+    def _buffer_database(self, record: dict) -> None:
+        self.store.add(record)
+        self.database_changed = True
+
+    def _buffer_rss(self, pod_type: str, pod_items: list[dict], feed: dict) -> None:
+        self.pending_items[pod_type] = pod_items + self.pending_items.get(pod_type, [])
+        self.pending_feed = feed
+
+    def recover(self) -> None:
+        """Buffer the unsaved changes of a previous run from the journal."""
+        records = self.journal.replay()
+        if not records:
+            return
+        logger.warning(f"Recovering {len(records)} unsaved changes of {self.name}")
+        for record in records:
+            if record["type"] == "database":
+                self._buffer_database(record["record"])
+            elif record["type"] == "rss":
+                self._buffer_rss(record["pod_type"], record["items"], record["feed"])
+
+    def checkpoint(self) -> None:
+        """Mark an entry as processed, and flush if the checkpoint is reached."""
+        self.entries_since_flush += 1
+        if self.entries_since_flush >= self.checkpoint_entries or time.monotonic() - self.last_flush >= self.checkpoint_seconds:
+            self.flush()
+
+    def update_index(self, *, force: bool = False) -> None:
+        """Update this feed in the processed index of the platform, and upload the index.
+
+        The index is only rewritten if the feed changed or is missing from it,
+        e.g. when the feed was processed before the index existed.
+        """
+        if not self.platform:
+            return
+        # Feeds of a multi-feed run share the index file, so it must not change while it is uploaded.
+        with INDEX_LOCK:
+            index = ProcessedIndex(index_path(Path(self.db_path).parent, self.platform))
+            try:
+                if not force and index.has_feed(self.name):
+                    return
+                index.update_feed(self.name, self.store, self.deferred)
+            finally:
+                index.close()
+            gh.upload_release(index.path, "metadata")
+
+    def flush(self) -> None:
+        """Save and upload buffered changes of RSS feeds and the database.
+
+        RSS feeds are uploaded before the database, so an entry is never published as processed
+        while its items are missing from the feeds.
+        """
+        for pod_type, pod_items in self.pending_items.items():
+            # Items are upserted by guid, since items replayed from the journal may have been uploaded already.
+            xml_path = Path(f"{pod_type}/{self.name}.xml")
+            with metrics.span("write_rss", self.name) as span:
+                pod_header = generate_pod_header(self.pending_feed, self.config, pod_type)
+                splice_xml(pod_header, pod_items, xml_path, keep=self.keep_items)
+                span.add(items=len(pod_items), bytes=xml_path.stat().st_size)
+            gh.upload_release(xml_path, pod_type)
+        index_changed = self.database_changed
+        if self.database_changed:
+            with metrics.span("write_database", self.name):
+                self.store.export_json(self.db_path)
+            gh.upload_release(self.db_path, self.db_name)
+        if self.deferred.save():
+            gh.upload_release(self.deferred.path, "metadata")
+            index_changed = True
+        self.update_index(force=index_changed)
 
-        Path(pod_type).mkdir(parents=True, exist_ok=True)
-        cached_rss = load_xml(f"{pod_type}/{self.name}.xml")
-        cached_items = cached_rss["rss"]["channel"].get("item", [])
-        if isinstance(cached_items, dict):
-            cached_items = [cached_items]
-        pod_items.extend(cached_items)
-        pod_header = generate_pod_header(feed, self.config, pod_type)
-        save_xml(pod_header, pod_items, f"{pod_type}/{self.name}.xml")
-        gh.upload_release(f"{pod_type}/{self.name}.xml", pod_type)
+        self.journal.clear()
+        self.pending_items = {}
+        self.database_changed = False
+        self.entries_since_flush = 0
+        self.last_flush = time.monotonic()
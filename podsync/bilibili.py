@@ -2,25 +2,54 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-import argparse
 import asyncio
-import os
 import re
+import signal
 import sys
 from pathlib import Path
 
-import dateparser
-import feedparser
-from base import PodSync
+from base import PodSync, select_feeds
+from cli import get_parser, run
+from dates import format_date, parse_pub_date
+from extraction import extract_flat, extractor
+from feeds import FeedFetcher, bilibili_feed_url
 from loguru import logger
-from videogram.utils import delete_files, load_json
-from videogram.ytdlp import ytdlp_extract_info
-from yt_dlp.utils import DownloadError, ExtractorError
+from metrics import metrics
+from utils import delete_files, load_json
 
 
 class Bilibili(PodSync):
-    def __init__(self, name: str, config: dict, database_path: Path) -> None:
-        super().__init__(name, config, database_path)
+    platform = "bilibili"
+
+    def __init__(self, name: str, config: dict, database_path: Path, **kwargs) -> None:
+        super().__init__(name, config, database_path, **kwargs)
+
+    def get_vid(self, entry: dict) -> str:
+        return Path(entry["link"]).stem
+
+    def get_cover(self, entry: dict) -> str:
+        if re.search(r'img src="(.*)"', entry["summary"]):
+            return re.search(r'img src="(.*)"', entry["summary"]).group(1)  # type: ignore
+        return self.config.get("cover", "")
+
+    def cleanup_entry(self, entry: dict) -> None:
+        prefix = entry["title"][:60]
+        delete_files(Path(".").glob(f"{prefix}*"))
+
+    def prefetch(self, entries: list[dict]) -> None:
+        """Check that new videos are available with a single listing of the uploader's videos.
+
+        Deleted and geo-restricted videos are not listed, so they are still checked one by one.
+        Listed entries are cached with ``flat=True``, see `check_entry`.
+        """
+        wanted = {Path(x["link"]).stem: x for x in entries}
+        found = 0
+        for info in extract_flat(f"https://space.bilibili.com/{self.config['uid']}/video", limit=len(entries) + 10):
+            entry = wanted.pop(info.get("id"), None)
+            if entry is not None:
+                extractor.put(entry["link"], info, flat=True)
+                found += 1
+        logger.info(f"Prefetched {found} of {len(entries)} new videos from the uploader's space")
 
     def check_entry(self, entry: dict) -> dict:
         """Check if the entry is valid for download.
@@ -44,21 +73,26 @@ class Bilibili(PodSync):
         Returns:
             dict: A dictionary contains the information of the entry.
         """
+        from yt_dlp.utils import DownloadError, ExtractorError
+
         res = {
             "need_update_database": False,
             "metadata": {},
             "need_download": False,
         }
         # log metadata
-        publish_time = dateparser.parse(entry["published"], settings={"TO_TIMEZONE": os.getenv("TZ", "UTC")})
-        res["metadata"] = {"title": entry["title"], "vid": Path(entry["link"]).stem, "time": f"{publish_time:%a, %d %b %Y %H:%M:%S %z}"}
+        publish_time = parse_pub_date(entry["published"])
+        res["metadata"] = {"title": entry["title"], "vid": Path(entry["link"]).stem, "time": format_date(publish_time)}
         res["need_update_database"] = True
         try:
-            # test if the video is available
-            ytdlp_extract_info(entry["link"], use_cookie=False, playlist=False, process=False)[0]
+            # test if the video is available, a video listed in the uploader's space is
+            if extractor.get(entry["link"], flat=True) is None:
+                extractor.extract_info(entry["link"], use_cookie=False, process=False)
         except ExtractorError as e:
             logger.error(f"ExtractorError: {e.msg}")
-            raise
+            res["need_update_database"] = False
+            res["defer"] = {"reason": f"ExtractorError: {e.msg}"}
+            return res
         except DownloadError as e:
             logger.error(f"DownloadError: {e.msg}")
             if "HTTPError 404" in str(e.msg):
@@ -76,75 +110,92 @@ class Bilibili(PodSync):
         return res
 
 
-async def main():
-    logger.info(f"Processing {args.name}")
+async def sync_feed(conf: dict, fetcher: FeedFetcher) -> None:
+    logger.info(f"Processing {conf['name']}")
     # initialize bilibili
-    conf: dict = next(x for x in load_json(args.config) if x["name"] == args.name)
-    bilibili = Bilibili(args.name, conf, Path(args.metadata_dir) / f"{args.name}.json")
+    bilibili = Bilibili(
+        conf["name"],
+        conf,
+        Path(args.metadata_dir) / f"{conf['name']}.json",
+        checkpoint_entries=args.checkpoint_entries,
+        checkpoint_seconds=args.checkpoint_seconds,
+        keep_items=args.keep,
+        download_workers=args.download_workers,
+        batch_threshold=args.batch_threshold,
+    )
+    if args.recover_only:
+        bilibili.flush()
+        return
     # process feed
-    processed_vids = {x["vid"] for x in bilibili.database}
-    remote = feedparser.parse(f"{os.getenv('RSSHUB_URL', 'https://rsshub.app')}/bilibili/user/video/{conf['uid']}")
-    for entry in remote["entries"][:5][::-1]:  # 5 videos from oldest to latest
-        vid = Path(entry["link"]).stem
-        if vid in processed_vids:
-            logger.debug(f"Skip processed: {entry['title']}")
-            continue
-        logger.info(f"New video found: [{entry['link']}] {entry['title']}")
-        res = await bilibili.process_single_entry(entry, use_cookie=False)
-        # Update
-        bilibili.update_database(res["entry_info"])
-        if not res["download_info"]:
-            continue
-
-        # get cover url
-        if re.search(r'img src="(.*)"', entry["summary"]):  # noqa: SIM108
-            cover = re.search(r'img src="(.*)"', entry["summary"]).group(1)  # type: ignore
-        else:
-            cover = conf.get("cover", "")
-
-        # audio
-        if not conf.get("skip_audio", False):
-            bilibili.upload_files("audio", res["download_info"]["audio_info"], vid)
-            audio_items = bilibili.get_pod_items(
-                pod_type="audio",
-                info_list=res["download_info"]["audio_info"],
-                vid=vid,
-                entry=entry,
-                cover=cover,
-            )
-            bilibili.update_pod_rss("audio", audio_items, feed=remote["feed"])
-
-        # video
-        if not conf.get("skip_video", False):
-            bilibili.upload_files("video", res["download_info"]["video_info"], vid)
-            video_items = bilibili.get_pod_items(
-                pod_type="video",
-                info_list=res["download_info"]["video_info"],
-                vid=vid,
-                entry=entry,
-                cover=cover,
-            )
-            bilibili.update_pod_rss("video", video_items, feed=remote["feed"])
-        # Cleanup
-        prefix = entry["title"][:60]
-        delete_files(Path(".").glob(f"{prefix}*"))
+    try:
+        with metrics.span("feed_fetch", conf["name"]):
+            remote = await fetcher.fetch(bilibili_feed_url(conf))
+        if remote is None:
+            logger.error(f"Feed of {conf['name']} is not available.")
+            return
+        bilibili.deferred.prune(Path(entry["link"]).stem for entry in remote["entries"])
+        new_entries = []
+        for entry in remote["entries"][:5][::-1]:  # 5 videos from oldest to latest
+            if bilibili.is_processed(Path(entry["link"]).stem):
+                logger.debug(f"Skip processed: {entry['title']}")
+                continue
+            if bilibili.is_deferred(Path(entry["link"]).stem):
+                logger.debug(f"Skip deferred: {entry['title']}")
+                continue
+            logger.info(f"New video found: [{entry['link']}] {entry['title']}")
+            new_entries.append(entry)
+
+        await bilibili.run_pipeline(
+            new_entries,
+            remote["feed"],
+            use_cookie=False,
+            download_concurrency=args.download_concurrency,
+            upload_concurrency=args.upload_concurrency,
+            queue_size=args.queue_size,
+            min_free_space=int(args.min_free_space * 1024**3),
+        )
+    finally:
+        bilibili.flush()
+
+
+async def main():
+    confs = select_feeds(load_json(args.config), args.name)  # type: ignore
+    fetcher = FeedFetcher()
+    semaphore = asyncio.Semaphore(args.feed_concurrency)
+
+    async def sync_limited(conf: dict) -> None:
+        async with semaphore:
+            await sync_feed(conf, fetcher)
+
+    results = await asyncio.gather(*(sync_limited(conf) for conf in confs), return_exceptions=True)
+    failed = []
+    for conf, res in zip(confs, results, strict=True):
+        if isinstance(res, BaseException):
+            logger.opt(exception=res).error(f"Failed to sync {conf['name']}")
+            failed.append(conf["name"])
+    if failed:
+        raise RuntimeError(f"Failed to sync {len(failed)} of {len(confs)} feeds: {', '.join(failed)}")
 
 
 if __name__ == "__main__":
     # parse arguments
-    parser = argparse.ArgumentParser(description="Sync Bilibili to Telegram")
-    parser.add_argument("--log-level", type=str, default="INFO", required=False, help="Log level")
+    parser = get_parser("Sync Bilibili to Telegram")
     parser.add_argument("--config", type=str, default="config/bilibili.json", required=False, help="Path to configuration json file.")
     parser.add_argument("--metadata-dir", type=str, default="metadata", required=False, help="Path to metadata directory.")
-    parser.add_argument("--name", type=str, required=True, help="Feed name.")
+    parser.add_argument("--name", type=str, nargs="+", required=True, help='Feed names, also separated by commas, or "all" for every feed in the config.')
+    parser.add_argument("--feed-concurrency", type=int, default=1, required=False, help="How many feeds to sync at the same time.")
+    parser.add_argument("--checkpoint-entries", type=int, default=5, required=False, help="Upload database and RSS changes after this number of entries.")
+    parser.add_argument("--checkpoint-seconds", type=float, default=600, required=False, help="Upload database and RSS changes at least every this number of seconds.")
+    parser.add_argument("--keep", type=int, default=None, required=False, help="How many items to keep in RSS feeds.")
+    parser.add_argument("--download-concurrency", type=int, default=1, required=False, help="How many new entries to download at the same time.")
+    parser.add_argument("--upload-concurrency", type=int, default=1, required=False, help="How many downloaded entries to upload at the same time.")
+    parser.add_argument("--queue-size", type=int, default=2, required=False, help="How many downloaded entries can wait for upload.")
+    parser.add_argument("--min-free-space", type=float, default=2, required=False, help="Minimum free disk space in GiB to start a new download.")
+    parser.add_argument("--download-workers", type=int, default=2, required=False, help="Number of threads for extraction and download.")
+    parser.add_argument("--batch-threshold", type=int, default=3, required=False, help="Prefetch video info in a batch if there are at least this number of new entries.")
+    parser.add_argument("--recover-only", action="store_true", help="Only upload unsaved changes of a killed run.")
     args = parser.parse_args()
 
-    # loguru settings
-    logger.remove()  # Remove default handler.
-    logger.add(
-        sys.stderr,
-        colorize=True,
-        level=args.log_level,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green>| <level>{level: <7}</level> | <cyan>{name: <10}</cyan>:<cyan>{function: ^30}</cyan>:<cyan>{line: >4}</cyan> - <level>{message}</level>",
-    )
-    asyncio.run(main())
+    # Exit gracefully on SIGTERM (e.g. job timeout), so buffered changes are flushed.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(143))
+    run(main, args)
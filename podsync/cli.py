@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import argparse
+import asyncio
+import inspect
+import io
+import os
+import sys
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+from metrics import metrics
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+LOG_FORMAT = "<green>{time:YYYY-MM-DD HH:mm:ss}</green>| <level>{level: <7}</level> | <cyan>{name: <10}</cyan>:<cyan>{function: ^30}</cyan>:<cyan>{line: >4}</cyan> - <level>{message}</level>"
+
+
+def get_parser(description: str) -> argparse.ArgumentParser:
+    """Get an argument parser with the options shared by all scripts: logging, metrics and profiling."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--log-level", type=str, default="INFO", required=False, help="Log level")
+    parser.add_argument("--metrics", type=str, default=os.getenv("PODSYNC_METRICS"), required=False, help="Write a JSON report of the time, bytes and counts of each stage to this path.")
+    parser.add_argument("--metrics-prom", type=str, default=os.getenv("PODSYNC_METRICS_PROM"), required=False, help="Also write the metrics as a Prometheus textfile to this path.")
+    parser.add_argument("--profile", type=str, default=None, choices=["cprofile", "tracemalloc"], required=False, help="Profile CPU time or memory allocations of the run.")
+    parser.add_argument("--profile-out", type=str, default=None, required=False, help="Save the raw profile to this path, for pstats/snakeviz or tracemalloc.Snapshot.load.")
+    parser.add_argument("--profile-top", type=int, default=20, required=False, help="Number of hot spots in the profile summary of the log.")
+    return parser
+
+
+def setup_logging(level: str) -> None:
+    logger.remove()  # Remove default handler.
+    logger.add(sys.stderr, colorize=True, level=level, format=LOG_FORMAT)
+
+
+def run(main: Callable[[], Any], args: argparse.Namespace) -> Any:
+    """Set up logging and metrics, and run the main function of a script, under the profiler if ``--profile`` is given.
+
+    Coroutine functions are run with `asyncio.run` inside the profiler, so the whole event loop is profiled.
+    cProfile follows the main thread, where the event loop runs, and work in thread pools shows up as waiting for it.
+    tracemalloc traces allocations of all threads.
+
+    The top hot spots are logged when the run ends, also if it fails.
+    """
+    setup_logging(args.log_level)
+    metrics.configure(args.metrics, args.metrics_prom)
+
+    def call() -> Any:
+        return asyncio.run(main()) if inspect.iscoroutinefunction(main) else main()
+
+    if args.profile == "cprofile":
+        return _run_cprofile(call, args.profile_out, args.profile_top)
+    if args.profile == "tracemalloc":
+        return _run_tracemalloc(call, args.profile_out, args.profile_top)
+    return call()
+
+
+def _run_cprofile(call: Callable[[], Any], out: str | None, top: int) -> Any:
+    import cProfile
+    import pstats
+
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(call)
+    finally:
+        for sort in ("tottime", "cumulative"):
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).strip_dirs().sort_stats(sort).print_stats(top)
+            logger.info(f"Top {top} functions by {sort}:\n{stream.getvalue().rstrip()}")
+        if out:
+            profile.dump_stats(out)
+            logger.info(f"CPU profile saved to {out}")
+
+
+def _run_tracemalloc(call: Callable[[], Any], out: str | None, top: int) -> Any:
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        return call()
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        lines = [f"Traced memory: {current / 1024**2:.1f} MiB at exit, {peak / 1024**2:.1f} MiB at peak"]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[:top]]
+        logger.info(f"Top {top} allocations by line:\n" + "\n".join(lines))
+        if out:
+            snapshot.dump(out)
+            logger.info(f"Allocation snapshot saved to {out}")
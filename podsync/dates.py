@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import os
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+from loguru import logger
+
+RFC822_FORMAT = "%a, %d %b %Y %H:%M:%S %z"
+
+
+def parse_date(text: str, tz: str | None = None) -> datetime | None:
+    """Parse a date string of feeds, and convert it to the given timezone.
+
+    YouTube Atom feeds use ISO 8601 and RSSHub uses RFC 822, both are parsed by the standard library.
+    Other formats, and dates without timezone, fall back to dateparser, which is much slower.
+
+    Args:
+        text (str): date string
+        tz (str | None, optional): target timezone. Defaults to the TZ environment variable or "UTC".
+
+    Returns:
+        datetime | None: timezone-aware datetime, or None if the string can not be parsed.
+    """
+    return _parse_date(text, tz or os.getenv("TZ", "UTC"))
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(text: str, tz: str) -> datetime | None:
+    parsed = _parse_strict(text)
+    if parsed is not None:
+        try:
+            return parsed.astimezone(ZoneInfo(tz))
+        except (KeyError, ValueError):  # not an IANA timezone name, let dateparser handle it
+            pass
+
+    import dateparser
+
+    return dateparser.parse(text, settings={"TO_TIMEZONE": tz})
+
+
+def parse_pub_date(text: str) -> datetime:
+    """Parse the publish date of a feed or an entry, or use the current time if it can not be parsed.
+
+    A broken date of a single entry should not stop the feed, and the entry is published when it is found.
+    """
+    date = parse_date(text)
+    if date is None:
+        logger.warning(f"Can not parse publish date {text!r}, use the current time")
+        return datetime.now(UTC)
+    return date
+
+
+def _parse_strict(text: str) -> datetime | None:
+    text = text.strip()
+    try:
+        parsed = datetime.fromisoformat(text) if text[:4].isdigit() else parsedate_to_datetime(text)
+    except (TypeError, ValueError):
+        return None
+    # naive datetimes are interpreted in the local timezone by dateparser
+    return parsed if parsed.tzinfo is not None else None
+
+
+def format_date(date: datetime) -> str:
+    """Format a datetime in RFC 822, which is used in RSS feeds and metadata."""
+    return f"{date:{RFC822_FORMAT}}"
@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from dates import format_date, parse_date
+from loguru import logger
+from utils import load_json, save_json
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+
+def deferred_path(json_path: str | Path) -> Path:
+    """Path of the deferred entries of a feed, which is next to its metadata, e.g. metadata/<name>-deferred.json"""
+    json_path = Path(json_path)
+    return json_path.with_name(f"{json_path.stem}-deferred.json")
+
+
+class DeferredEntries:
+    """Entries that can not be processed yet, e.g. upcoming videos, live streams and videos failed to extract.
+
+    They are not recorded in the metadata, so they look new in every feed check.
+    Each entry has a next retry time, and both the scheduler and the workers ignore it until then.
+    The delay doubles with every attempt, and an upcoming video is retried at its premiere time.
+    """
+
+    def __init__(self, path: str | Path, base_delay: timedelta = timedelta(hours=1), max_delay: timedelta = timedelta(days=1)) -> None:
+        """Initialize DeferredEntries.
+
+        Args:
+            path (str | Path): Path of the json file, see `deferred_path`.
+            base_delay (timedelta, optional): Delay after the first attempt. Defaults to 1 hour.
+            max_delay (timedelta, optional): Maximum delay between two attempts. Defaults to 1 day.
+        """
+        self.path = Path(path)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.entries: dict[str, dict] = load_json(self.path, default={})  # type: ignore
+        self.changed = False
+
+    def __contains__(self, vid: str) -> bool:
+        return vid in self.entries
+
+    def is_due(self, vid: str, now: datetime | None = None) -> bool:
+        """Whether the entry should be checked now, which is always true for entries that are not deferred."""
+        record = self.entries.get(vid)
+        if record is None:
+            return True
+        next_retry = parse_date(record["next_retry"])
+        return next_retry is None or next_retry <= (now or datetime.now(UTC))
+
+    def defer(self, vid: str, reason: str, retry_at: datetime | None = None) -> None:
+        """Defer an entry.
+
+        Args:
+            vid (str): video id
+            reason (str): why the entry can not be processed, e.g. "is_upcoming".
+            retry_at (datetime | None, optional): When to retry, e.g. the premiere time.
+                Defaults to None, which means exponential backoff by the number of attempts.
+        """
+        now = datetime.now(UTC)
+        attempts = self.entries.get(vid, {}).get("attempts", 0) + 1
+        if retry_at is None or retry_at <= now:
+            retry_at = now + min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+        self.entries[vid] = {"reason": reason, "attempts": attempts, "next_retry": format_date(retry_at)}
+        self.changed = True
+        logger.info(f"Defer {vid} ({reason}) until {format_date(retry_at)}, attempt {attempts}")
+
+    def resolve(self, vid: str) -> None:
+        if self.entries.pop(vid, None) is not None:
+            self.changed = True
+
+    def prune(self, vids: Iterable[str]) -> None:
+        """Forget deferred entries that are not in the given vids, e.g. entries that left the feed."""
+        keep = set(vids)
+        for vid in [x for x in self.entries if x not in keep]:
+            self.resolve(vid)
+
+    def save(self) -> bool:
+        """Save the deferred entries if they are changed.
+
+        Returns:
+            bool: whether the file is saved.
+        """
+        if not self.changed:
+            return False
+        save_json(self.entries, self.path)
+        self.changed = False
+        return True
@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from loguru import logger
+from metrics import metrics
+from utils import CACHE_DIR
+
+# Only these fields are kept on disk, the formats of a single video can take hundreds of kilobytes.
+CACHED_FIELDS = (
+    "id",
+    "title",
+    "description",
+    "channel",
+    "uploader",
+    "duration",
+    "live_status",
+    "availability",
+    "timestamp",
+    "release_timestamp",
+    "upload_date",
+    "shorts",  # set on entries of the shorts tab, see `YouTube.prefetch`
+)
+# The info of these videos changes soon, so it is never written to disk.
+UNFINISHED_STATUS = {"is_upcoming", "is_live", "post_live"}
+
+
+class ExtractionCache:
+    """Cache of yt-dlp extraction results.
+
+    Extraction is the slowest request to YouTube and the first one to be throttled,
+    so each url is extracted at most once per run, and finished videos are also kept
+    on disk for ``ttl`` seconds, which lets the next scheduled run skip them.
+
+    Only checking entries goes through the cache. Downloads still extract the video once more,
+    since ``videogram`` downloads by url and needs the full formats, which are never cached.
+    """
+
+    def __init__(self, cache_dir: str | Path = CACHE_DIR / "extract", ttl: float = float(os.getenv("PODSYNC_EXTRACT_TTL", "21600"))) -> None:
+        """Initialize ExtractionCache.
+
+        Args:
+            cache_dir (str | Path, optional): Directory of the on-disk cache. Defaults to "extract" under the cache directory.
+            ttl (float, optional): Seconds before an on-disk result expires, 0 disables the on-disk cache.
+                Defaults to the PODSYNC_EXTRACT_TTL environment variable or 6 hours.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.memo: dict[str, dict] = {}
+
+    @staticmethod
+    def _key(url: str, options: dict) -> str:
+        return json.dumps([url, options], sort_keys=True)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{hashlib.sha1(key.encode()).hexdigest()}.json"  # noqa: S324
+
+    def _load(self, key: str) -> dict | None:
+        path = self._path(key)
+        if self.ttl <= 0 or not path.exists():
+            return None
+        try:
+            with path.open() as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - cached["time"] > self.ttl:
+            return None
+        return cached["info"]
+
+    def _save(self, key: str, info: dict) -> None:
+        if self.ttl <= 0 or info.get("live_status") in UNFINISHED_STATUS:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("w") as f:
+            json.dump({"time": time.time(), "info": {k: info[k] for k in CACHED_FIELDS if k in info}}, f, ensure_ascii=False, default=str)
+        tmp_path.replace(path)
+
+    def put(self, url: str, info: dict, **options) -> None:
+        """Cache the info of a url that is extracted somewhere else, e.g. by a playlist extraction."""
+        key = self._key(url, options)
+        self.memo[key] = info
+        self._save(key, info)
+
+    def extract_info(self, url: str, **options) -> dict:
+        """Extract the info of a single video with ``ytdlp_extract_info``, or get it from the cache.
+
+        Args:
+            url (str): video url
+            **options: options of ``ytdlp_extract_info``, e.g. ``process=False``. Different options are cached separately.
+
+        Returns:
+            dict: info of the video. Results from the on-disk cache only have the fields in ``CACHED_FIELDS``.
+        """
+        info = self.get(url, **options)
+        if info is None:
+            from videogram.ytdlp import ytdlp_extract_info
+
+            with metrics.span("extract_info"):
+                info = ytdlp_extract_info(url, playlist=False, **options)[0]
+            self.put(url, info, **options)
+        return info
+
+    def get(self, url: str, **options) -> dict | None:
+        """Get the cached info of a url without extracting it, or None if it is not cached."""
+        key = self._key(url, options)
+        if key in self.memo:
+            metrics.count("extract_info", memo_hits=1)
+            return self.memo[key]
+        info = self._load(key)
+        if info is not None:
+            logger.debug(f"Extraction cache hit: {url}")
+            metrics.count("extract_info", disk_hits=1)
+            self.memo[key] = info
+        return info
+
+
+@metrics.timed()
+def extract_flat(url: str, limit: int | None = None) -> list[dict]:
+    """Extract the entries of a channel tab or playlist without visiting each video.
+
+    This is a single request per page of the listing, but entries only have the fields shown in the listing,
+    e.g. YouTube entries have duration and badges, but not the full availability.
+
+    Args:
+        url (str): channel tab or playlist url
+        limit (int | None, optional): Maximum number of entries. Defaults to None, which means all entries.
+
+    Returns:
+        list[dict]: flat entries of the listing.
+    """
+    import yt_dlp
+
+    options = {"quiet": True, "no_warnings": True, "extract_flat": "in_playlist", "playlistend": limit}
+    with yt_dlp.YoutubeDL(options) as ydl:  # type: ignore
+        info = ydl.extract_info(url, download=False)
+    return [dict(x) for x in (info or {}).get("entries") or [] if x]
+
+
+extractor = ExtractionCache()
@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from loguru import logger
+from metrics import metrics
+from utils import CACHE_DIR
+
+
+def youtube_feed_url(conf: dict) -> str:
+    return f"https://www.youtube.com/feeds/videos.xml?channel_id={conf['yt_channel']}"
+
+
+def bilibili_feed_url(conf: dict) -> str:
+    return f"{os.getenv('RSSHUB_URL', 'https://rsshub.app')}/bilibili/user/video/{conf['uid']}"
+
+
+def youtube_remote_vids(remote: dict) -> dict[str, str]:
+    """Get vids of a YouTube feed, mapped to their published dates."""
+    return {x["yt_videoid"]: x.get("published", "") for x in remote["entries"]}
+
+
+def bilibili_remote_vids(remote: dict) -> dict[str, str]:
+    """Get vids of the 5 latest entries of a Bilibili feed, mapped to their published dates."""
+    return {Path(x["link"]).stem: x.get("published", "") for x in remote["entries"][:5]}
+
+
+class FeedCache:
+    """On-disk cache of HTTP validators and parsed feeds, keyed by feed url.
+
+    Each feed is stored in its own file, so concurrent fetches never write the same file.
+    Besides ETag and Last-Modified, the sha256 digest of the response body is kept,
+    because some RSSHub instances do not send validators but still return identical bodies.
+    """
+
+    def __init__(self, cache_dir: str | Path = CACHE_DIR / "feeds") -> None:
+        self.cache_dir = Path(cache_dir)
+
+    def _path(self, url: str) -> Path:
+        return self.cache_dir / f"{hashlib.sha1(url.encode()).hexdigest()}.json"  # noqa: S324
+
+    def load(self, url: str) -> dict:
+        path = self._path(url)
+        if not path.exists():
+            return {}
+        try:
+            with path.open() as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignore broken feed cache of {url}: {e}")
+            return {}
+
+    def save(self, url: str, data: dict) -> None:
+        path = self._path(url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("w") as f:
+            json.dump({"url": url, **data}, f, ensure_ascii=False, default=str)
+        tmp_path.replace(path)
+
+
+class FeedFetcher:
+    """Fetch many feeds concurrently.
+
+    Blocking HTTP requests and ``feedparser.parse`` run in worker threads, so the event loop only schedules them.
+    The global semaphore caps the total number of in-flight requests, and each host has its own semaphore,
+    so a slow RSSHub instance can only occupy its own slots and never starves the YouTube requests.
+
+    Requests are conditional: the cached ETag and Last-Modified are sent, and a 304 response or
+    an unchanged body returns the cached feed without calling ``feedparser.parse`` again.
+    """
+
+    def __init__(self, concurrency: int = 8, per_host: int = 4, timeout: float = 30, cache: FeedCache | None = None) -> None:
+        """Initialize FeedFetcher.
+
+        Args:
+            concurrency (int, optional): Maximum number of feeds fetched at the same time. Defaults to 8.
+            per_host (int, optional): Maximum number of feeds fetched from the same host at the same time. Defaults to 4.
+            timeout (float, optional): Timeout in seconds of a single feed, including parsing. Defaults to 30.
+            cache (FeedCache | None, optional): Validator cache. Defaults to FeedCache() under the cache directory.
+        """
+        self.timeout = timeout
+        self.cache = cache or FeedCache()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.host_semaphores: dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(per_host))
+        self.session = requests.Session()
+
+    def _fetch(self, url: str) -> dict:
+        host = urlsplit(url).netloc
+        cached = self.cache.load(url)
+        headers = {}
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and "feed" in cached:
+            logger.debug(f"Not modified: {url}")
+            metrics.count("feed_request", host, not_modified=1)
+            return cached["feed"]
+        response.raise_for_status()
+
+        validators = {
+            "etag": response.headers.get("ETag", ""),
+            "last_modified": response.headers.get("Last-Modified", ""),
+            "digest": hashlib.sha256(response.content).hexdigest(),
+        }
+        if validators["digest"] == cached.get("digest") and "feed" in cached:
+            logger.debug(f"Unchanged body: {url}")
+            metrics.count("feed_request", host, bytes=len(response.content), unchanged=1)
+            if any(cached.get(k) != v for k, v in validators.items()):
+                self.cache.save(url, {**validators, "feed": cached["feed"]})
+            return cached["feed"]
+
+        import feedparser  # imported on demand, it is slow to import
+
+        parsed = feedparser.parse(response.content)
+        metrics.count("feed_request", host, bytes=len(response.content), parsed=1)
+        feed = {"feed": parsed["feed"], "entries": parsed["entries"]}
+        self.cache.save(url, {**validators, "feed": feed})
+        return feed
+
+    async def fetch(self, url: str) -> dict | None:
+        """Fetch and parse a single feed.
+
+        Args:
+            url (str): feed url
+
+        Returns:
+            dict | None: feed parsed by feedparser, or None if the feed can not be fetched in time.
+        """
+        host = urlsplit(url).netloc
+        # Wait for the host slot first, so tasks queued behind a slow host do not hold global slots.
+        async with self.host_semaphores[host], self.semaphore:
+            logger.debug(f"Fetching {url}")
+            try:
+                return await asyncio.wait_for(asyncio.to_thread(metrics.wrap("feed_request", host, self._fetch), url), timeout=self.timeout)
+            except TimeoutError:
+                logger.error(f"Timeout fetching {url}")
+            except Exception as e:  # noqa: BLE001
+                logger.error(f"Failed to fetch {url}: {e}")
+        return None
+
+    async def fetch_all(self, urls: list[str]) -> dict[str, dict | None]:
+        """Fetch feeds concurrently.
+
+        Args:
+            urls (list[str]): feed urls
+
+        Returns:
+            dict[str, dict | None]: parsed feeds, keyed by url.
+        """
+        results = await asyncio.gather(*(self.fetch(url) for url in urls))
+        return dict(zip(urls, results, strict=True))
@@ -2,52 +2,188 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import atexit
+import hashlib
+import mimetypes
 import os
+import random
+import re
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import requests
 from loguru import logger
+from metrics import metrics
+from utils import CACHE_DIR, load_json, save_json
 
-HEADERS = {
-    "Accept": "application/vnd.github+json",
-    "Authorization": f"Bearer {os.environ['GITHUB_TOKEN']}",
-    "X-GitHub-Api-Version": "2022-11-28",
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+# Parts of files that change on every write without changing the content, ignored when comparing uploads.
+VOLATILE_PATTERNS: dict[str, list[re.Pattern[bytes]]] = {
+    ".xml": [re.compile(rb"<lastBuildDate>[^<]*</lastBuildDate>")],
 }
 
 
 class Github:
-    def __init__(self, repo: str = os.getenv("GITHUB_REPOSITORY", "")) -> None:
-        self.repo = repo
-        assert self.repo, "Repo is not set"
+    """GitHub client.
+
+    Creating it has no side effects: the repository and token are read from the environment,
+    and the HTTP session is built, on first use.
+
+    All API calls go through `request`, which waits for rate limits and retries transient errors.
+    The release listing is cached on disk with the ETag of each page, so listing again costs only 304 responses,
+    which do not count against the rate limit. Our own uploads and deletes update the cached listing directly.
+
+    Uploads are skipped if the asset already has the same content, see `upload_release`.
+    """
+
+    def __init__(
+        self,
+        repo: str | None = None,
+        upload_workers: int = int(os.getenv("PODSYNC_UPLOAD_WORKERS", "3")),
+        volatile_patterns: dict[str, list[re.Pattern[bytes]]] | None = None,
+    ) -> None:
+        self._repo = repo
+        self.upload_workers = upload_workers
+        self.volatile_patterns = VOLATILE_PATTERNS if volatile_patterns is None else volatile_patterns
         self.releases = {}
+        self.release_pages: dict[str, dict] = {}  # page number -> {"etag": str, "releases": list}
+        self.lock = threading.RLock()
+
+    @cached_property
+    def repo(self) -> str:
+        repo = self._repo or os.getenv("GITHUB_REPOSITORY", "")
+        assert repo, "Repo is not set"
+        return repo
+
+    @cached_property
+    def session(self) -> requests.Session:
+        session = requests.Session()
+        session.headers.update(
+            {
+                "Accept": "application/vnd.github+json",
+                "Authorization": f"Bearer {os.environ['GITHUB_TOKEN']}",
+                "X-GitHub-Api-Version": "2022-11-28",
+            }
+        )
+        return session
+
+    @cached_property
+    def cache_path(self) -> Path:
+        return CACHE_DIR / "github" / f"{self.repo.replace('/', '@')}-releases.json"
+
+    @cached_property
+    def manifest_path(self) -> Path:
+        return CACHE_DIR / "github" / f"{self.repo.replace('/', '@')}-manifest.json"
+
+    @cached_property
+    def manifest(self) -> dict[str, dict]:
+        """Normalized content digests and asset ids of uploaded assets, keyed by "<release>/<asset>".
+
+        The id tells if the asset is still the one we uploaded, since it changes whenever the asset is replaced,
+        e.g. by another run or by hand.
+        """
+        return load_json(self.manifest_path, default={})  # type: ignore
+
+    def request(self, method: str, url: str, *, retries: int = 5, **kwargs) -> requests.Response:
+        """Send a request to GitHub, retrying rate-limited requests, server errors and connection errors.
+
+        Args:
+            method (str): HTTP method.
+            url (str): request url.
+            retries (int, optional): Maximum number of retries. Defaults to 5.
+            **kwargs: arguments of `requests.Session.request`. A file object in ``data`` is rewound before each attempt.
+
+        Returns:
+            requests.Response: the last response, whose status is not checked.
+        """
+        kwargs.setdefault("timeout", 30)
+        for attempt in range(retries + 1):
+            if hasattr(kwargs.get("data"), "seek"):
+                kwargs["data"].seek(0)
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"{e}, retry in {delay:.1f}s")
+            else:
+                delay = self._retry_delay(response, attempt)
+                if delay is None or attempt == retries:
+                    metrics.count("Github.request", requests=1, retries=attempt)
+                    return response
+                logger.warning(f"{method} {url} returns {response.status_code}, retry in {delay:.1f}s")
+            time.sleep(delay)
+        raise AssertionError("unreachable")
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Exponential backoff with jitter."""
+        return min(60, 2**attempt) * random.uniform(0.5, 1.5)  # noqa: S311
 
+    def _retry_delay(self, response: requests.Response, attempt: int) -> float | None:
+        """Get the delay before retrying a response, or None if it should not be retried."""
+        if response.status_code >= 400 and response.headers.get("Retry-After"):  # secondary rate limit
+            return float(response.headers["Retry-After"])
+        if response.status_code in {403, 429} and response.headers.get("X-RateLimit-Remaining") == "0":
+            return max(0, int(response.headers.get("X-RateLimit-Reset", time.time())) - time.time()) + 1
+        if response.status_code == 429 or response.status_code >= 500:
+            return self._backoff(attempt)
+        return None
+
+    @metrics.timed()
     def get_releases(self) -> dict[str, dict]:
         logger.debug(f"Fetching releases of {self.repo}")
         if self.releases:
             return self.releases
+        cached_pages: dict = load_json(self.cache_path, default={})  # type: ignore
         all_releases = []
         per_page = 100  # maximum is 100
         page = 1
-        res = requests.get(f"https://api.github.com/repos/{self.repo}/releases?per_page={per_page}&page={page}", headers=HEADERS, timeout=30).json()
-        all_releases.extend(res)
-        while len(res) == per_page:
-            page += 1
-            res = requests.get(f"https://api.github.com/repos/{self.repo}/releases?per_page={per_page}&page={page}", headers=HEADERS, timeout=30).json()
+        while True:
+            cached = cached_pages.get(str(page), {})
+            headers = {"If-None-Match": cached["etag"]} if cached.get("etag") else {}
+            response = self.request("GET", f"https://api.github.com/repos/{self.repo}/releases?per_page={per_page}&page={page}", headers=headers)
+            if response.status_code == 304:
+                metrics.count("Github.get_releases", not_modified=1)
+                res = cached["releases"]
+            else:
+                response.raise_for_status()
+                res = response.json()
+            self.release_pages[str(page)] = {"etag": response.headers.get("ETag", cached.get("etag", "")), "releases": res}
             all_releases.extend(res)
+            if len(res) < per_page:
+                break
+            page += 1
         logger.debug(f"Found {len(all_releases)} releases")
         self.releases = {release["name"]: release for release in all_releases}
+        self.save_cache()
+        atexit.register(self.save_cache)
         return self.releases
 
+    def save_cache(self):
+        """Save the release listing and the upload manifest, including changes made by this process, to disk."""
+        with self.lock:
+            if self.release_pages:
+                save_json(self.release_pages, self.cache_path)
+            if "manifest" in self.__dict__:
+                save_json(self.manifest, self.manifest_path)
+
     def get_release_assets(self, name: str) -> dict[str, dict]:
         logger.debug(f"Getting release assets of {self.repo}, release name: {name}")
-        if not self.releases:
-            release = self.get_releases().get(name, {})
         release = self.get_releases().get(name, {})
         return {
             asset["name"]: {
                 "updated_at": asset["updated_at"],
                 "id": asset["id"],
+                "size": asset["size"],
             }
             for asset in release.get("assets", [])
         }
@@ -57,10 +193,17 @@ class Github:
         command = f"gh release delete '{release_name}' --cleanup-tag --yes"
         subprocess.run(command, shell=True, check=False)  # noqa: S602
 
+    @metrics.timed()
     def delete_asset(self, asset_id: int):
         logger.debug(f"Delete asset {asset_id} [{self.repo}]")
-        requests.delete(f"https://api.github.com/repos/{self.repo}/releases/assets/{asset_id}", headers=HEADERS, timeout=30)
+        response = self.request("DELETE", f"https://api.github.com/repos/{self.repo}/releases/assets/{asset_id}")
+        if response.status_code != 404:  # already deleted
+            response.raise_for_status()
+        with self.lock:
+            for release in self.releases.values():
+                release["assets"] = [x for x in release.get("assets", []) if x["id"] != asset_id]
 
+    @metrics.timed()
     def edit_release(self, release_name: str, body: str, *, prerelease: bool = False, latest: bool = False, draft: bool = False):
         logger.debug(f"Edit release {release_name} [{self.repo}]")
         release = self.get_releases().get(release_name, {})
@@ -68,30 +211,132 @@ class Github:
             return
         api = f"https://api.github.com/repos/{self.repo}/releases/{release['id']}"
         data = {"tag_name": release_name, "body": body, "prerelease": prerelease, "make_latest": latest, "draft": draft}
-        requests.patch(api, headers=HEADERS, json=data, timeout=30)
+        self.request("PATCH", api, json=data).raise_for_status()
+
+    @metrics.timed()
+    def create_release(self, release_name: str) -> dict:
+        logger.info(f"Creating release {release_name} [{self.repo}]")
+        api = f"https://api.github.com/repos/{self.repo}/releases"
+        data = {"tag_name": release_name, "name": release_name, "body": release_name, "prerelease": True}
+        response = self.request("POST", api, json=data)
+        response.raise_for_status()
+        release = response.json()
+        release.setdefault("assets", [])
+        self.releases[release_name] = release
+        self.release_pages.setdefault("1", {"etag": "", "releases": []})["releases"].insert(0, release)
+        return release
+
+    @metrics.timed()
+    def upload_release(self, path: str | Path, release_name: str, *, clean=False, force=False):
+        """Upload a file to a release, replacing the asset with the same name.
+
+        The release is created if it does not exist. The file is streamed from disk,
+        and a failed upload raises `requests.HTTPError`.
+
+        If the asset exists and its content is unchanged, the upload is skipped. Content is compared by
+        the digest recorded in the upload manifest, after removing `volatile_patterns` (e.g. lastBuildDate of RSS),
+        if the asset is still the one we uploaded, or by the sha256 digest GitHub reports for the asset.
 
-    def upload_release(self, path: str | Path, release_name: str, *, clean=False):
+        Args:
+            path (str | Path): path of the file.
+            release_name (str): release name, which is also its tag.
+            clean (bool, optional): Whether to delete the local file after uploading. Defaults to False.
+            force (bool, optional): Whether to upload even if the content is unchanged. Defaults to False.
+        """
         path = Path(path).resolve()
         assert path.exists(), f"File not found: {path}"
-        if not self.releases:
-            self.releases = self.get_releases()
-        if release_name not in self.releases:
-            logger.info(f"Creating release {release_name} [{self.repo}]")
-            command = f"gh release create '{release_name}' --prerelease -n '{release_name}' -t '{release_name}' -R '{self.repo}' > /dev/null 2>&1 || true"
-            subprocess.run(command, shell=True, check=False)  # noqa: S602
+        with self.lock:
+            release = self.get_releases().get(release_name) or self.create_release(release_name)
+        existing = [asset for asset in release.get("assets", []) if asset["name"] == path.name]
+        key = f"{release_name}/{path.name}"
+        digest = ""
+        if existing:
+            raw_digest, digest = self.get_digests(path)
+            uploaded = self.manifest.get(key)
+            unchanged = isinstance(uploaded, dict) and uploaded == {"digest": digest, "id": existing[0]["id"]}
+            if not force and (unchanged or existing[0].get("digest") == f"sha256:{raw_digest}"):
+                logger.info(f"Skip unchanged {path.name} in {release_name} [{self.repo}]")
+                metrics.count("Github.upload_release", skipped=1)
+                if clean:
+                    path.unlink(missing_ok=True)
+                return
+        for asset in existing:
+            self.delete_asset(asset["id"])
+
         logger.info(f"Uploading {path.name} to {release_name} [{self.repo}]")
-        command = f"gh release upload --clobber '{release_name}' -- '{path.as_posix()}'"
-        subprocess.run(command, shell=True, check=False)  # noqa: S602
+        headers = {
+            "Content-Type": mimetypes.guess_type(path.name)[0] or "application/octet-stream",
+            "Content-Length": str(path.stat().st_size),
+        }
+        with path.open("rb") as f:
+            response = self.request(
+                "POST",
+                f"https://uploads.github.com/repos/{self.repo}/releases/{release['id']}/assets",
+                params={"name": path.name},
+                headers=headers,
+                data=f,
+                timeout=(30, 600),
+            )
+        response.raise_for_status()
+        metrics.count("Github.upload_release", bytes=int(headers["Content-Length"]))
+        asset = response.json()
+        with self.lock:
+            release["assets"] = [*release.get("assets", []), asset]
+            if digest or path.suffix in self.volatile_patterns:  # other new assets are compared by the digest GitHub reports
+                self.manifest[key] = {"digest": digest or self.get_digests(path)[1], "id": asset["id"]}
         if clean:
             path.unlink(missing_ok=True)
 
+    def get_digests(self, path: Path) -> tuple[str, str]:
+        """Get the sha256 digests of a file, before and after removing volatile parts."""
+        patterns = self.volatile_patterns.get(path.suffix, [])
+        if not patterns:
+            raw = hashlib.sha256()
+            with path.open("rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    raw.update(chunk)
+            return raw.hexdigest(), raw.hexdigest()
+        data = path.read_bytes()
+        raw_digest = hashlib.sha256(data).hexdigest()
+        for pattern in patterns:
+            data = pattern.sub(b"", data)
+        return raw_digest, hashlib.sha256(data).hexdigest()
+
+    @metrics.timed()
+    def upload_assets(self, paths: Iterable[str | Path], release_name: str, *, clean=False, workers: int | None = None):
+        """Upload files to a release in parallel.
+
+        Args:
+            paths (Iterable[str | Path]): paths of the files.
+            release_name (str): release name, which is also its tag.
+            clean (bool, optional): Whether to delete the local files after uploading. Defaults to False.
+            workers (int | None, optional): Number of parallel uploads. Defaults to `upload_workers`.
+        """
+        with ThreadPoolExecutor(max_workers=workers or self.upload_workers) as executor:
+            futures = [executor.submit(self.upload_release, path, release_name, clean=clean) for path in paths]
+        for future in futures:
+            future.result()  # raise the first error
+
+    @metrics.timed()
     def trigger_workflow(self, feed_name: str, platform: str = "youtube") -> int:
         logger.info(f"Triggering workflow for {feed_name}")
         api = f"https://api.github.com/repos/{self.repo}/actions/workflows/single.yml/dispatches"
         data = {"ref": "main", "inputs": {"name": feed_name, "platform": platform}}
-        response = requests.post(api, headers=HEADERS, json=data, timeout=30)
+        response = self.request("POST", api, json=data)
         assert response.status_code == 204, f"Failed to trigger workflow: {response.text}"
         return response.status_code
 
+    @metrics.timed()
+    def get_active_runs(self, workflow: str = "single.yml") -> list[dict]:
+        """Get queued and in-progress runs of a workflow with a single API call.
+
+        The newest 100 runs are listed and completed runs are dropped,
+        since the API can only filter by one status at a time.
+        """
+        api = f"https://api.github.com/repos/{self.repo}/actions/workflows/{workflow}/runs"
+        response = self.request("GET", api, params={"per_page": 100, "exclude_pull_requests": "true"})
+        response.raise_for_status()
+        return [x for x in response.json()["workflow_runs"] if x["status"] != "completed"]
+
 
 gh = Github()
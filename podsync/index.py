@@ -0,0 +1,157 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from cli import get_parser, run
+from dates import parse_date
+from loguru import logger
+from store import get_timestamp
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from deferred import DeferredEntries
+    from store import MetadataStore
+
+
+def index_path(metadata_dir: str | Path, platform: str) -> Path:
+    """Path of the processed index of a platform, e.g. metadata/index-youtube.sqlite"""
+    return Path(metadata_dir) / f"index-{platform}.sqlite"
+
+
+class ProcessedIndex:
+    """Processed and deferred vids of all feeds of a platform in one small SQLite file.
+
+    The scheduler only needs to know which vids of a feed are processed, so it downloads this file
+    instead of the metadata of every feed. Workers of a platform run one at a time,
+    so each worker can update the rows of its feed and upload the file without conflicts.
+
+    Each feed also has a high-water mark, which is the newest processed vid and its publish time.
+    """
+
+    def __init__(self, path: str | Path, *, readonly: bool = False) -> None:
+        """Open a processed index.
+
+        Args:
+            path (str | Path): Path of the SQLite file, see `index_path`.
+            readonly (bool, optional): Open an existing file read-only and memory-mapped. Defaults to False.
+        """
+        self.path = Path(path)
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{self.path.as_posix()}?mode=ro&immutable=1", uri=True)
+            self.conn.execute(f"PRAGMA mmap_size = {max(self.path.stat().st_size, 1 << 20)}")
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS processed (
+                feed TEXT NOT NULL,
+                vid TEXT NOT NULL,
+                PRIMARY KEY (feed, vid)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS deferred (
+                feed TEXT NOT NULL,
+                vid TEXT NOT NULL,
+                reason TEXT,
+                next_retry REAL,
+                PRIMARY KEY (feed, vid)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS feeds (
+                feed TEXT PRIMARY KEY,
+                latest_vid TEXT,
+                latest_time REAL,
+                updated REAL
+            );
+            """
+        )
+
+    def has_feed(self, name: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM feeds WHERE feed = ?", (name,)).fetchone() is not None
+
+    def high_water_mark(self, name: str) -> tuple[str, float | None] | None:
+        """Get the newest processed vid of a feed and its publish timestamp."""
+        row = self.conn.execute("SELECT latest_vid, latest_time FROM feeds WHERE feed = ?", (name,)).fetchone()
+        return (row[0], row[1]) if row and row[0] else None
+
+    def pending(self, name: str, vids: Iterable[str], now: float | None = None) -> set[str]:
+        """Get vids that are neither processed nor deferred until later.
+
+        Args:
+            name (str): feed name
+            vids (Iterable[str]): vids in the remote feed.
+            now (float | None, optional): Current POSIX timestamp. Defaults to time.time().
+
+        Returns:
+            set[str]: vids that should be processed.
+        """
+        vids = set(vids)
+        if not vids:
+            return set()
+        now = time.time() if now is None else now
+        marks = ",".join("?" * len(vids))
+        done = {
+            row[0]
+            for row in self.conn.execute(
+                f"SELECT vid FROM processed WHERE feed = ? AND vid IN ({marks}) "  # noqa: S608
+                f"UNION SELECT vid FROM deferred WHERE feed = ? AND next_retry > ? AND vid IN ({marks})",
+                (name, *vids, name, now, *vids),
+            )
+        }
+        return vids - done
+
+    def update_feed(self, name: str, store: MetadataStore, deferred: DeferredEntries | None = None) -> None:
+        """Replace the rows of a feed with its metadata store and deferred entries."""
+        newest = store.newest(limit=1)
+        with self.conn:
+            self.conn.execute("DELETE FROM processed WHERE feed = ?", (name,))
+            self.conn.executemany("INSERT OR IGNORE INTO processed (feed, vid) VALUES (?, ?)", ((name, x["vid"]) for x in store))
+            self.conn.execute("DELETE FROM deferred WHERE feed = ?", (name,))
+            if deferred is not None:
+                self.conn.executemany(
+                    "INSERT INTO deferred (feed, vid, reason, next_retry) VALUES (?, ?, ?, ?)",
+                    ((name, vid, x["reason"], next_retry.timestamp() if (next_retry := parse_date(x["next_retry"])) else 0) for vid, x in deferred.entries.items()),
+                )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO feeds (feed, latest_vid, latest_time, updated) VALUES (?, ?, ?, ?)",
+                (name, newest[0]["vid"] if newest else None, get_timestamp(newest[0]) if newest else None, time.time()),
+            )
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def main():
+    from deferred import DeferredEntries, deferred_path
+    from github import gh
+    from store import open_store
+    from utils import load_json
+
+    path = index_path(args.metadata_dir, args.platform)
+    index = ProcessedIndex(path)
+    for conf in load_json(args.config):
+        json_path = Path(args.metadata_dir) / f"{conf['name']}.json"
+        if not json_path.exists():
+            continue
+        logger.info(f"Indexing {conf['name']}")
+        store = open_store(json_path)
+        index.update_feed(conf["name"], store, DeferredEntries(deferred_path(json_path)))
+        store.close()
+    index.close()
+    if args.upload:
+        gh.upload_release(path, "metadata")
+
+
+if __name__ == "__main__":
+    parser = get_parser("Rebuild the processed index of a platform from metadata files.")
+    parser.add_argument("--platform", type=str, default="youtube", required=False, help="Social media platform.")
+    parser.add_argument("--config", type=str, default="config/youtube.json", required=False, help="Path to configuration json file.")
+    parser.add_argument("--metadata-dir", type=str, default="metadata", required=False, help="Path to metadata directory.")
+    parser.add_argument("--upload", action="store_true", help="Upload the index to the metadata release.")
+    args = parser.parse_args()
+    run(main, args)
@@ -0,0 +1,44 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+from loguru import logger
+
+
+class Journal:
+    """Append-only journal of changes that are not uploaded yet.
+
+    Each change is written as one json line and synced to disk before it is buffered in memory,
+    so the changes can be replayed if the process is killed before the next flush.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+
+    def append(self, record: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def replay(self) -> list[dict]:
+        """Read all complete records of the journal, from the oldest to the newest."""
+        if not self.path.exists():
+            return []
+        records = []
+        with self.path.open() as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # The last line may be incomplete if the process was killed while writing it.
+                    logger.warning(f"Skip broken journal line in {self.path}")
+        return records
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
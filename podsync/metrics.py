@@ -0,0 +1,215 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import atexit
+import functools
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Self
+
+from dates import format_date
+from loguru import logger
+from utils import save_json
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+
+class Span:
+    """Time a block of code and collect counts of it, e.g. ``span.add(bytes=size, parts=2)``."""
+
+    __slots__ = ("counts", "feed", "metrics", "stage", "start")
+
+    def __init__(self, metrics: Metrics, stage: str, feed: str) -> None:
+        self.metrics = metrics
+        self.stage = stage
+        self.feed = feed
+        self.counts: dict[str, float] = {}
+        self.start = 0.0
+
+    def add(self, **counts: float) -> None:
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def __enter__(self) -> Self:
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.metrics.record(self.stage, self.feed, time.perf_counter() - self.start, self.counts, error=exc_type is not None)
+
+
+class NullSpan(Span):
+    """Span of disabled metrics, which records nothing."""
+
+    def __init__(self) -> None:
+        pass
+
+    def add(self, **counts: float) -> None:
+        pass
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Metrics:
+    """Wall time, call counts, bytes and other counts of each stage of a run, per feed.
+
+    Metrics are disabled until `configure` is called with an output path, and disabled spans are a shared no-op object,
+    so instrumented code costs one attribute check. Spans can nest and run in many threads at the same time,
+    so the seconds of a stage are the sum of its spans, which can be longer than the run.
+
+    At exit, a JSON report and optionally a Prometheus textfile (for the node exporter textfile collector) are written,
+    and the slowest stages are logged.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.json_path: Path | None = None
+        self.prom_path: Path | None = None
+        self.lock = threading.Lock()
+        self.stats: dict[tuple[str, str], dict[str, float]] = {}
+        self.started = datetime.now(UTC)
+        self.start = time.perf_counter()
+
+    def configure(self, json_path: str | Path | None = None, prom_path: str | Path | None = None) -> None:
+        """Enable metrics if any output path is given, and write the outputs at exit.
+
+        Args:
+            json_path (str | Path | None, optional): Path of the JSON run report. Defaults to None.
+            prom_path (str | Path | None, optional): Path of the Prometheus textfile. Defaults to None.
+        """
+        self.json_path = Path(json_path) if json_path else None
+        self.prom_path = Path(prom_path) if prom_path else None
+        if (self.json_path or self.prom_path) and not self.enabled:
+            self.enabled = True
+            atexit.register(self.write)
+
+    def span(self, stage: str, feed: str = "") -> Span:
+        """Time a block of code as a stage of a feed.
+
+        Examples:
+            >>> with metrics.span("upload_files", feed) as span:
+            ...     span.add(bytes=size)
+        """
+        return Span(self, stage, feed) if self.enabled else NULL_SPAN
+
+    def timed(self, stage: str | None = None, feed: str = "") -> Callable[[Callable], Callable]:
+        """Decorate a blocking function to time each call as a stage. The stage defaults to the qualified name of the function."""
+
+        def decorator(func: Callable) -> Callable:
+            name = stage or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with Span(self, name, feed):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def wrap(self, stage: str, feed: str, func: Callable) -> Callable:
+        """Time calls of a function as a stage of a feed, e.g. a function run in an executor."""
+        return self.timed(stage, feed)(func) if self.enabled else func
+
+    def count(self, stage: str, feed: str = "", **counts: float) -> None:
+        """Add counts to a stage without timing it."""
+        if self.enabled:
+            self.record(stage, feed, None, counts)
+
+    def record(self, stage: str, feed: str, seconds: float | None, counts: dict[str, float], *, error: bool = False) -> None:
+        """Add a call of a stage, if it is timed, and its counts.
+
+        Counts are a dict rather than keyword arguments, so any name can be counted, including "error".
+        """
+        with self.lock:
+            stats = self.stats.setdefault((stage, feed), defaultdict(int))
+            if seconds is not None:
+                stats["calls"] += 1
+                stats["seconds"] += seconds
+                stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            if error:
+                stats["errors"] += 1
+            for key, value in counts.items():
+                stats[key] += value
+
+    def report(self) -> dict:
+        """Get the run report, with the total of each stage and the stats of each feed."""
+        stages: dict[str, dict] = {}
+        with self.lock:
+            items = sorted((key, dict(stats)) for key, stats in self.stats.items())
+        for (stage, feed), stats in items:
+            total = stages.setdefault(stage, {"calls": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "feeds": {}})
+            for key, value in stats.items():
+                total[key] = max(total.get(key, 0), value) if key == "max_seconds" else total.get(key, 0) + value
+            if feed:
+                total["feeds"][feed] = stats
+        return {
+            "started": format_date(self.started),
+            "duration": time.perf_counter() - self.start,
+            "argv": sys.argv,
+            "stages": dict(sorted(stages.items(), key=lambda x: x[1]["seconds"], reverse=True)),
+        }
+
+    def to_prometheus(self, report: dict) -> str:
+        """Format the stats of each stage and feed in the Prometheus text format."""
+        lines = [
+            "# TYPE podsync_run_duration_seconds gauge",
+            f"podsync_run_duration_seconds {report['duration']:.6f}",
+            "# TYPE podsync_run_timestamp_seconds gauge",
+            f"podsync_run_timestamp_seconds {self.started.timestamp():.0f}",
+        ]
+        samples: dict[str, list[str]] = defaultdict(list)
+        with self.lock:
+            items = sorted((key, dict(stats)) for key, stats in self.stats.items())
+        for (stage, feed), stats in items:
+            labels = f'stage="{_escape(stage)}",feed="{_escape(feed)}"'
+            for key, value in stats.items():
+                name = f"podsync_stage_{_metric_name(key)}" + ("" if key == "max_seconds" else "_total")
+                samples[name].append(f"{name}{{{labels}}} {value:g}")
+        for name, values in samples.items():
+            lines.append(f"# TYPE {name} {'gauge' if name.endswith('max_seconds') else 'counter'}")
+            lines.extend(values)
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        """Write the JSON report and the Prometheus textfile, and log the slowest stages."""
+        report = self.report()
+        for stage, total in list(report["stages"].items())[:10]:
+            logger.info(f"Stage {stage}: {total['calls']:g} calls, {total['errors']:g} errors, {total['seconds']:.1f}s")
+        if self.json_path:
+            save_json(report, self.json_path)
+            logger.info(f"Metrics report saved to {self.json_path}")
+        if self.prom_path:
+            # Written atomically, since the textfile collector may read it at any time.
+            self.prom_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.prom_path.with_name(f".{self.prom_path.name}.{os.getpid()}")
+            tmp_path.write_text(self.to_prometheus(report))
+            tmp_path.replace(self.prom_path)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _metric_name(key: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", key)
+
+
+metrics = Metrics()
@@ -5,13 +5,9 @@ from __future__ import annotations
 import os
 import uuid
 from datetime import datetime
-from typing import TYPE_CHECKING
 from zoneinfo import ZoneInfo
 
-import dateparser
-
-if TYPE_CHECKING:
-    from pathlib import Path
+from dates import format_date, parse_pub_date
 
 """Apple Podcast Specification
 
@@ -33,9 +29,9 @@ def generate_pod_header(feed_info: dict, config: dict, pod_type: str) -> dict:
     """
     now = datetime.now(tz=ZoneInfo("UTC"))
     if "published" in feed_info:
-        pub_date = dateparser.parse(feed_info["published"], settings={"TO_TIMEZONE": os.getenv("TZ", "UTC")})
+        pub_date = parse_pub_date(feed_info["published"])
     elif "updated" in feed_info:
-        pub_date = dateparser.parse(feed_info["updated"], settings={"TO_TIMEZONE": os.getenv("TZ", "UTC")})
+        pub_date = parse_pub_date(feed_info["updated"])
     else:
         pub_date = now
     feed_url = f"https://github.com/{os.environ['GITHUB_REPOSITORY']}/releases/download/{pod_type}/{config['name']}.xml"
@@ -71,8 +67,8 @@ def generate_pod_header(feed_info: dict, config: dict, pod_type: str) -> dict:
                 # Common tags for rss
                 "category": "TV & Film",
                 "generator": "PodSync",
-                "lastBuildDate": f"{now:%a, %d %b %Y %H:%M:%S %z}",
-                "pubDate": f"{pub_date:%a, %d %b %Y %H:%M:%S %z}",
+                "lastBuildDate": format_date(now),
+                "pubDate": format_date(pub_date),
                 "image": {
                     "url": config["cover"],
                     "title": feed_info["title"],
@@ -88,46 +84,45 @@ def generate_pod_item(
     feed_entry: dict,
     pod_type: str,
     release_name: str,
-    filepath: Path,
+    asset_name: str,
+    size: int,
     cover: str,
     duration: int,
+    part: int = 1,
 ) -> dict:
     """Generate podcast item for RSS feed.
 
     We will upload audio and video files to GitHub release, and generate RSS feed for podcast.
+    The media file is not needed, so items can be generated again from the metadata, see `generate_pod_items`.
 
     Args:
-        feed_entry (dict): entry parsed from feedparser
+        feed_entry (dict): entry parsed from feedparser, or rebuilt from metadata with `entry_from_record`.
         pod_type (str): podcast type. Choices: "audio", "video"
         release_name (str): GitHub release name
-        filepath (Path): path to the media file
+        asset_name (str): name of the uploaded media file in the release
+        size (int): size of the media file in bytes
         cover (str): cover image url
         duration (int): duration of the media file in seconds
+        part (int, optional): part number of a video split into several files. Defaults to 1.
 
     Returns:
         dict: podcast item for RSS feed
     """
-    pub_date = dateparser.parse(feed_entry["published"], settings={"TO_TIMEZONE": os.getenv("TZ", "UTC")})
-    if pod_type == "audio":
-        enclosure = {
-            "@url": f"https://github.com/{os.environ['GITHUB_REPOSITORY']}/releases/download/{release_name}/{filepath.name}",
-            "@length": filepath.stat().st_size,
-            "@type": "audio/x-m4a",
-        }
-    else:
-        enclosure = {
-            "@url": f"https://github.com/{os.environ['GITHUB_REPOSITORY']}/releases/download/{release_name}/{filepath.name}",
-            "@length": filepath.stat().st_size,
-            "@type": "video/mp4",
-        }
+    pub_date = parse_pub_date(feed_entry["published"])
+    enclosure = {
+        "@url": f"https://github.com/{os.environ['GITHUB_REPOSITORY']}/releases/download/{release_name}/{asset_name}",
+        "@length": size,
+        "@type": "audio/x-m4a" if pod_type == "audio" else "video/mp4",
+    }
 
     return {
         # Required tags
-        "title": f"【{filepath.stat().st_size/1024/1024:.0f}MB】{feed_entry['title']}",
+        "title": f"【{size/1024/1024:.0f}MB】{feed_entry['title']}",
         "enclosure": enclosure,
-        "guid": feed_entry["link"],
+        # parts share the link, but each of them is a separate episode
+        "guid": feed_entry["link"] if part == 1 else f"{feed_entry['link']}#P{part}",
         # Recommended tags
-        "pubDate": f"{pub_date:%a, %d %b %Y %H:%M:%S %z}",
+        "pubDate": format_date(pub_date),
         "description": feed_entry["summary"],
         "itunes:duration": duration,
         "link": feed_entry["link"],
@@ -136,6 +131,39 @@ def generate_pod_item(
     }
 
 
+def generate_pod_items(feed_entry: dict, pod_type: str, release_name: str, media: list[dict], cover: str) -> list[dict]:
+    """Generate podcast items of all parts of an entry.
+
+    Args:
+        feed_entry (dict): entry parsed from feedparser, or rebuilt from metadata with `entry_from_record`.
+        pod_type (str): podcast type. Choices: "audio", "video"
+        release_name (str): GitHub release name
+        media (list[dict]): uploaded media files, each has "part", "asset", "size" and "duration".
+        cover (str): cover image url
+
+    Returns:
+        list[dict]: podcast items, from the first part to the last.
+    """
+    return [
+        generate_pod_item(
+            feed_entry,
+            pod_type=pod_type,
+            release_name=release_name,
+            asset_name=x["asset"],
+            size=x["size"],
+            cover=cover,
+            duration=x["duration"],
+            part=x["part"],
+        )
+        for x in media
+    ]
+
+
+def entry_from_record(record: dict) -> dict:
+    """Rebuild the fields of a feed entry used by `generate_pod_item` from a metadata record."""
+    return {"title": record["title"], "link": record["link"], "summary": record.get("summary", ""), "published": record["time"]}
+
+
 def generate_podcast_uuid(url: str):
     """Generate podcast UUID from URL.
 
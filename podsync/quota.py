@@ -0,0 +1,180 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from cli import get_parser, run
+from github import gh
+from loguru import logger
+from retention import asset_to_vid, guid_to_vid, read_guids
+from store import MetadataStore, get_timestamp, open_store
+from utils import load_json, trim_xml
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(text: str) -> int:
+    """Parse a size like "500M" or "1.5T" to bytes."""
+    matched = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)I?B?\s*", text.upper())
+    if not matched:
+        raise ValueError(f"Invalid size: {text}")
+    return int(float(matched.group(1)) * SIZE_UNITS[matched.group(2)])
+
+
+def format_size(size: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+class QuotaPlan:
+    """Evict media across all feeds until the release storage fits a global budget.
+
+    Everything is computed from one release listing: the bytes of each release, and the media assets of each feed
+    grouped by vid, so the parts of a split video are evicted together. The newest ``min_keep`` entries of each feed
+    are never evicted, then candidates are evicted from the oldest, or from the largest, until the budget holds.
+
+    Evicted entries stay in the metadata with ``"evicted": true`` and without media, so they are still processed
+    and never downloaded again, while their RSS items and assets are removed.
+    """
+
+    def __init__(self, stores: dict[str, MetadataStore], budget: int, *, min_keep: dict[str, int], policy: str = "oldest") -> None:
+        """Compute the quota plan.
+
+        Args:
+            stores (dict[str, MetadataStore]): metadata of each feed, keyed by feed name, which is also its release name.
+            budget (int): Maximum total bytes of all release assets.
+            min_keep (dict[str, int]): Number of newest entries of each feed that are never evicted.
+            policy (str, optional): "oldest" evicts the oldest entries first, "largest" the largest first. Defaults to "oldest".
+        """
+        if policy not in {"oldest", "largest"}:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        releases = gh.get_releases()
+        self.release_bytes = {name: sum(x["size"] for x in release.get("assets", [])) for name, release in releases.items()}
+        self.total = sum(self.release_bytes.values())
+        self.budget = budget
+
+        candidates = []  # (sort key, feed, vid, bytes)
+        self.assets: dict[str, dict[str, list[int]]] = {}  # feed -> vid -> asset ids
+        for name, store in stores.items():
+            vid_bytes: dict[str, int] = defaultdict(int)
+            vid_assets: dict[str, list[int]] = defaultdict(list)
+            known_vids = {x["vid"] for x in store}
+            for asset in releases.get(name, {}).get("assets", []):
+                vid = asset_to_vid(asset["name"], known_vids)
+                if vid is not None:
+                    vid_bytes[vid] += asset["size"]
+                    vid_assets[vid].append(asset["id"])
+            self.assets[name] = vid_assets
+            for idx, record in enumerate(store.newest()):
+                if idx < min_keep.get(name, 0) or record["vid"] not in vid_bytes:
+                    continue
+                size = vid_bytes[record["vid"]]
+                timestamp = get_timestamp(record) or 0
+                candidates.append(((timestamp, -size) if policy == "oldest" else (-size, timestamp), name, record["vid"], size))
+
+        self.evict: dict[str, set[str]] = defaultdict(set)
+        self.freed = 0
+        for _, name, vid, size in sorted(candidates):
+            if self.total - self.freed <= budget:
+                break
+            self.evict[name].add(vid)
+            self.freed += size
+
+    def report(self, top: int = 10) -> None:
+        for name, size in sorted(self.release_bytes.items(), key=lambda x: x[1], reverse=True)[:top]:
+            logger.info(f"Release {name}: {format_size(size)}")
+        logger.info(f"Total {format_size(self.total)}, budget {format_size(self.budget)}")
+        for name, vids in sorted(self.evict.items()):
+            logger.info(f"{name}: evict {len(vids)} entries")
+        after = self.total - self.freed
+        if after > self.budget:
+            logger.warning(f"Budget can not be reached without evicting protected entries, {format_size(after)} after eviction")
+        else:
+            logger.info(f"Evict {format_size(self.freed)}, {format_size(after)} after eviction")
+
+    def apply(
+        self,
+        stores: dict[str, MetadataStore],
+        metadata_dir: str | Path,
+        *,
+        pod_types: dict[str, tuple[str, ...]] | None = None,
+        workers: int = 8,
+    ) -> None:
+        """Evict entries, with one update of the RSS feeds and metadata of each affected feed.
+
+        Like `RetentionPlan.apply`, RSS feeds are uploaded first and assets are deleted last.
+        Nothing is changed if an RSS feed of an affected feed is missing, and no asset is deleted
+        if an evicted entry is still in an RSS feed after trimming, since its items would point to deleted assets.
+
+        Args:
+            stores (dict[str, MetadataStore]): metadata of each feed, keyed by feed name.
+            metadata_dir (str | Path): Path to metadata directory.
+            pod_types (dict[str, tuple[str, ...]] | None, optional): RSS feeds of each feed, keyed by feed name.
+                Defaults to None, which means ("audio", "video") for every feed.
+            workers (int, optional): Number of assets deleted at the same time. Defaults to 8.
+
+        Raises:
+            RuntimeError: if an RSS feed is missing or still has evicted entries.
+        """
+        pod_types = pod_types or {}
+        xml_paths = {name: [Path(f"{pod_type}/{name}.xml") for pod_type in pod_types.get(name, ("audio", "video"))] for name in self.evict}
+        missing = [path.as_posix() for paths in xml_paths.values() for path in paths if not path.exists() or path.stat().st_size == 0]
+        if missing:
+            raise RuntimeError(f"RSS feeds are missing or empty, refuse to evict: {', '.join(missing)}")
+
+        asset_ids = []
+        for name, vids in self.evict.items():
+            for xml_path in xml_paths[name]:
+                if trim_xml(xml_path, accept=lambda guid, vids=vids: guid_to_vid(guid) not in vids):
+                    gh.upload_release(xml_path, xml_path.parent.name)
+                if remaining := {guid_to_vid(guid) for guid in read_guids(xml_path)} & vids:
+                    raise RuntimeError(f"{xml_path} still has {len(remaining)} evicted entries after trimming, refuse to delete assets")
+            store = stores[name]
+            for vid in vids:
+                record = store.get(vid)
+                if record is not None:
+                    record.pop("media", None)
+                    store.add({**record, "evicted": True})
+            metadata_path = Path(metadata_dir) / f"{name}.json"
+            store.export_json(metadata_path)
+            gh.upload_release(metadata_path, "metadata")
+            asset_ids.extend(x for vid in vids for x in self.assets[name].get(vid, []))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(gh.delete_asset, asset_ids))
+
+def main():
+    confs = [x for config in args.config for x in load_json(config)]  # type: ignore
+    stores = {}
+    for conf in confs:
+        metadata_path = Path(args.metadata_dir) / f"{conf['name']}.json"
+        if metadata_path.exists():
+            stores[conf["name"]] = open_store(metadata_path)
+    min_keep = {x["name"]: x.get("min_keep", args.min_keep) for x in confs}
+    pod_types = {x["name"]: tuple(t for t in ("audio", "video") if not x.get(f"skip_{t}", False)) for x in confs}
+    plan = QuotaPlan(stores, parse_size(args.budget), min_keep=min_keep, policy=args.policy)
+    plan.report()
+    if not args.dry_run:
+        plan.apply(stores, args.metadata_dir, pod_types=pod_types, workers=args.workers)
+    for store in stores.values():
+        store.close()
+
+
+if __name__ == "__main__":
+    # parse arguments
+    parser = get_parser("Evict old media of all feeds to fit a storage budget")
+    parser.add_argument("--config", type=str, nargs="+", default=["config/youtube.json", "config/bilibili.json"], required=False, help="Path to configuration json files.")
+    parser.add_argument("--metadata-dir", type=str, default="metadata", required=False, help="Path to metadata directory.")
+    parser.add_argument("--budget", type=str, required=True, help='Maximum total size of all release assets, e.g. "500G".')
+    parser.add_argument("--min-keep", type=int, default=5, required=False, help='Newest entries of each feed that are never evicted, overridden by "min_keep" in the feed config.')
+    parser.add_argument("--policy", type=str, default="oldest", choices=["oldest", "largest"], required=False, help="Which entries to evict first.")
+    parser.add_argument("--workers", type=int, default=8, required=False, help="Number of assets deleted at the same time.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be evicted.")
+    args = parser.parse_args()
+    run(main, args)
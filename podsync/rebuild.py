@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from base import select_feeds
+from cli import get_parser, run
+from feeds import FeedFetcher, bilibili_feed_url, youtube_feed_url
+from github import gh
+from loguru import logger
+from podcast import entry_from_record, generate_pod_header, generate_pod_items
+from store import open_store
+from utils import load_json, save_xml, splice_xml
+
+FEED_URLS = {
+    "youtube": youtube_feed_url,
+    "bilibili": bilibili_feed_url,
+}
+
+
+def rebuild_feed(conf: dict, feed_info: dict) -> int:
+    """Generate the RSS feeds of a feed from its metadata, without any media file.
+
+    Records processed before the media were recorded in the metadata are skipped,
+    and their existing items are kept unless ``--replace`` is given.
+
+    Returns:
+        int: number of generated items.
+    """
+    name = conf["name"]
+    store = open_store(Path(args.metadata_dir) / f"{name}.json")
+    records = store.newest(limit=args.keep)
+    store.close()
+    count = 0
+    for pod_type in ["audio", "video"]:
+        if conf.get(f"skip_{pod_type}", False):
+            continue
+        items = []
+        for record in records:
+            media = record.get("media", {}).get(pod_type)
+            if media:
+                items.extend(generate_pod_items(entry_from_record(record), pod_type, name, media, record.get("cover") or conf.get("cover", "")))
+        header = generate_pod_header(feed_info, conf, pod_type)
+        xml_path = Path(f"{pod_type}/{name}.xml")
+        if args.replace:
+            save_xml(header, items[: args.keep] if args.keep else items, xml_path)
+        else:
+            splice_xml(header, items, xml_path, keep=args.keep)
+        logger.info(f"Rebuilt {len(items)} items of {name} {pod_type}")
+        count += len(items)
+        if args.upload:
+            gh.upload_release(xml_path, pod_type)
+    return count
+
+
+async def get_feed_infos(confs: list[dict]) -> dict[str, dict]:
+    """Get the channel info of each feed for RSS headers, falling back to the config if the feed is not available."""
+    get_feed_url = FEED_URLS[args.platform]
+    urls = {conf["name"]: get_feed_url(conf) for conf in confs}
+    remotes = {} if args.offline else await FeedFetcher().fetch_all(list(urls.values()))
+    infos = {}
+    for conf in confs:
+        remote = remotes.get(urls[conf["name"]])
+        infos[conf["name"]] = remote["feed"] if remote else {"title": conf.get("title", conf["name"]), "link": urls[conf["name"]]}
+    return infos
+
+
+def main():
+    confs = select_feeds(load_json(args.config), args.name)  # type: ignore
+    confs = [x for x in confs if (Path(args.metadata_dir) / f"{x['name']}.json").exists()]
+    feed_infos = asyncio.run(get_feed_infos(confs))
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        counts = list(executor.map(lambda conf: rebuild_feed(conf, feed_infos[conf["name"]]), confs))
+    logger.success(f"Rebuilt {sum(counts)} items of {len(confs)} feeds")
+
+
+if __name__ == "__main__":
+    # parse arguments
+    parser = get_parser("Rebuild RSS feeds from metadata")
+    parser.add_argument("--platform", type=str, default="youtube", choices=list(FEED_URLS), required=False, help="Social media platform.")
+    parser.add_argument("--config", type=str, default="config/youtube.json", required=False, help="Path to configuration json file.")
+    parser.add_argument("--metadata-dir", type=str, default="metadata", required=False, help="Path to metadata directory.")
+    parser.add_argument("--name", type=str, nargs="+", default=["all"], required=False, help='Feed names, also separated by commas, or "all" for every feed in the config.')
+    parser.add_argument("--keep", type=int, default=None, required=False, help="How many items to keep in RSS feeds.")
+    parser.add_argument("--replace", action="store_true", help="Only keep rebuilt items, instead of merging them into the existing RSS feeds.")
+    parser.add_argument("--offline", action="store_true", help="Do not fetch feeds, build RSS headers from the config.")
+    parser.add_argument("--workers", type=int, default=8, required=False, help="Number of feeds rebuilt at the same time.")
+    parser.add_argument("--upload", action="store_true", help="Upload rebuilt RSS feeds to GitHub releases.")
+    args = parser.parse_args()
+    run(main, args)
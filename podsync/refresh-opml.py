@@ -2,54 +2,81 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-import argparse
 import os
-import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import xmltodict
+from cli import get_parser, run
+from extraction import ExtractionCache
 from github import gh
 from loguru import logger
-from utils import load_xml
-from videogram.utils import load_json
-from videogram.ytdlp import ytdlp_extract_info
+from utils import CACHE_DIR, load_json, load_xml
+
+# Channel descriptions rarely change, so they are cached much longer than videos.
+channel_cache = ExtractionCache(CACHE_DIR / "channels", ttl=float(os.getenv("PODSYNC_CHANNEL_TTL", str(7 * 24 * 3600))))
 
 
 def get_youtube_description(yt_channel: str) -> str:
-    info: list[dict] = ytdlp_extract_info(f"https://www.youtube.com/channel/{yt_channel}", playlist=False, process=False)
-    return info[0]["description"] if info[0]["description"].strip() else info[0]["uploader"]
+    info = channel_cache.extract_info(f"https://www.youtube.com/channel/{yt_channel}", process=False)
+    return info["description"] if (info.get("description") or "").strip() else info["uploader"]
 
 
-def get_new_feeds(pod_type: str) -> tuple[bool, dict]:
-    assert pod_type in {"audio", "video"}
-    opml_path = f"{pod_type}/podsync.opml"
-    opml_data = load_xml(opml_path, template="opml")
+def load_configs() -> list[dict]:
+    configs = []
+    for conf_file in Path(args.config_path).glob("*.json"):
+        configs.extend(load_json(conf_file))
+    return configs
+
+
+def load_opml_feeds(pod_type: str) -> tuple[dict, list[dict]]:
+    opml_data = load_xml(f"{pod_type}/podsync.opml", template="opml")
     opml_feeds = opml_data["opml"]["body"]["outline"]
     if isinstance(opml_feeds, dict):
         opml_feeds = [opml_feeds]
+    return opml_data, opml_feeds
+
+
+def get_descriptions(configs: list[dict]) -> dict[str, str]:
+    """Get descriptions of YouTube channels concurrently, from the cache if possible.
+
+    Args:
+        configs (list[dict]): configurations of new feeds.
+
+    Returns:
+        dict[str, str]: description of each feed, keyed by feed name. Feeds without a YouTube channel use the title.
+    """
+
+    def describe(conf: dict) -> str:
+        if not conf.get("yt_channel"):
+            return conf["title"]
+        try:
+            return get_youtube_description(conf["yt_channel"])
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Failed to get description of {conf['name']}, use its title: {e}")
+            return conf["title"]
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        return dict(zip((x["name"] for x in configs), executor.map(describe, configs), strict=True))
+
+
+def get_new_feeds(pod_type: str, opml: tuple[dict, list[dict]], configs: list[dict], descriptions: dict[str, str]) -> tuple[bool, dict]:
+    assert pod_type in {"audio", "video"}
+    opml_data, opml_feeds = opml
     exist_feeds = [Path(feed["@xmlUrl"]).stem for feed in opml_feeds]
     logger.debug(f"Found {len(exist_feeds)} existing feeds of {pod_type}")
-    conf_feed_names = []
-    for conf_file in Path(args.config_path).glob("*.json"):
-        conf_data = load_json(conf_file)
-        conf_feed_names.extend(x["name"] for x in conf_data if not x.get(f"skip_{pod_type}"))
-        for conf in conf_data:
-            if conf["name"] in exist_feeds:
-                continue
-
-            if conf.get("yt_channel") and not conf.get(f"skip_{pod_type}"):  # noqa: SIM108
-                description = get_youtube_description(conf["yt_channel"])
-            else:
-                description = conf["title"]
-
-            opml_feeds.append(
-                {
-                    "@text": description,
-                    "@type": "rss",
-                    "@xmlUrl": f"https://github.com/{os.environ['GITHUB_REPOSITORY']}/releases/download/{pod_type}/{conf['name']}.xml",
-                    "@title": conf["title"],
-                }
-            )
+    conf_feed_names = [x["name"] for x in configs if not x.get(f"skip_{pod_type}")]
+    for conf in configs:
+        if conf["name"] in exist_feeds:
+            continue
+        opml_feeds.append(
+            {
+                "@text": conf["title"] if conf.get(f"skip_{pod_type}") else descriptions[conf["name"]],
+                "@type": "rss",
+                "@xmlUrl": f"https://github.com/{os.environ['GITHUB_REPOSITORY']}/releases/download/{pod_type}/{conf['name']}.xml",
+                "@title": conf["title"],
+            }
+        )
     logger.debug(f"Found {len(conf_feed_names)} config feeds of {pod_type}")
     has_update = set(exist_feeds) != set(conf_feed_names)
     # remove feeds not in configuration any more.
@@ -59,8 +86,17 @@ def get_new_feeds(pod_type: str) -> tuple[bool, dict]:
 
 
 def main():
+    configs = load_configs()
+    # Descriptions of feeds missing from any OPML are looked up once, and shared by audio and video.
+    opmls = {pod_type: load_opml_feeds(pod_type) for pod_type in ["audio", "video"]}
+    new_configs = []
+    for pod_type, (_, opml_feeds) in opmls.items():
+        exist_feeds = {Path(feed["@xmlUrl"]).stem for feed in opml_feeds}
+        new_configs.extend(x for x in configs if x["name"] not in exist_feeds and not x.get(f"skip_{pod_type}"))
+    descriptions = get_descriptions(list({x["name"]: x for x in new_configs}.values()))
+
     for pod_type in ["audio", "video"]:
-        has_update, new_opml = get_new_feeds(pod_type)
+        has_update, new_opml = get_new_feeds(pod_type, opmls[pod_type], configs, descriptions)
         if has_update:
             logger.info(f"Updating {pod_type} feeds")
             opml_path = f"{pod_type}/podsync.opml"
@@ -71,17 +107,8 @@ def main():
 
 if __name__ == "__main__":
     # parse arguments
-    parser = argparse.ArgumentParser(description="Sync YouTube to Telegram")
-    parser.add_argument("--log-level", type=str, default="INFO", required=False, help="Log level")
+    parser = get_parser("Sync YouTube to Telegram")
     parser.add_argument("--config-path", type=str, default="config", required=False, help="Directory path of config json files.")
+    parser.add_argument("--workers", type=int, default=4, required=False, help="Number of channel descriptions looked up at the same time.")
     args = parser.parse_args()
-
-    # loguru settings
-    logger.remove()  # Remove default handler.
-    logger.add(
-        sys.stderr,
-        colorize=True,
-        level=args.log_level,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green>| <level>{level: <7}</level> | <cyan>{name: <10}</cyan>:<cyan>{function: ^30}</cyan>:<cyan>{line: >4}</cyan> - <level>{message}</level>",
-    )
-    main()
+    run(main, args)
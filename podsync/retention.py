@@ -0,0 +1,149 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qs, urlsplit
+
+from dates import parse_date
+from github import gh
+from loguru import logger
+from store import MetadataStore, get_timestamp
+from utils import get_item_guid, iter_item_spans, trim_xml
+
+if TYPE_CHECKING:
+    from collections.abc import Container
+
+# <vid>.m4a, <vid>.mp4, and <vid>-P2.mp4 etc. for videos split into several parts
+MEDIA_ASSET = re.compile(r"^(?P<vid>.+?)(?:-P(?P<part>\d+))?\.(?:m4a|mp4|mp3)$")
+
+
+def guid_to_vid(guid: str) -> str:
+    """Get the vid of a podcast item from its guid, which is the video link with an optional "#P<n>" part suffix."""
+    url = urlsplit(guid)
+    if "v" in (query := parse_qs(url.query)):  # https://www.youtube.com/watch?v=<vid>
+        return query["v"][0]
+    return Path(url.path).stem  # https://www.bilibili.com/video/<vid>
+
+
+def asset_to_vid(name: str, known_vids: Container[str] = ()) -> str | None:
+    """Get the vid of a media asset, or None if the asset is not a media file.
+
+    Known vids are matched first, so a vid that itself ends with "-P<n>" is not taken as a part of another vid.
+    """
+    matched = MEDIA_ASSET.match(name)
+    if matched is None:
+        return None
+    stem = name.rsplit(".", 1)[0]
+    return stem if stem in known_vids else matched.group("vid")
+
+
+def read_guids(path: str | Path) -> list[str]:
+    """Get the guids of all items of an RSS file, or an empty list if the file does not exist."""
+    path = Path(path)
+    if not path.exists():
+        return []
+    data = path.read_bytes()
+    return [get_item_guid(data, start, end) for start, end in iter_item_spans(data)]
+
+
+class RetentionPlan:
+    """What to remove from a feed, computed once and applied to the metadata, both RSS feeds and the release assets.
+
+    A record is kept if it is one of the newest ``keep`` records and it is published after ``now - max_age``.
+    Records without a publish time are only limited by count. Everything else is derived from the kept vids,
+    so the metadata, RSS items and assets of a feed always expire together.
+
+    Since everything missing from the metadata is removed, the plan refuses to run on metadata that looks broken,
+    e.g. an empty file left by a failed download, and assets without any record are only removed if asked to.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        store: MetadataStore,
+        *,
+        keep: int | None = None,
+        max_age: timedelta | None = None,
+        delete_orphans: bool = False,
+        orphan_grace: timedelta = timedelta(days=1),
+        min_coverage: float = 0.5,
+        pod_types: tuple[str, ...] = ("audio", "video"),
+    ) -> None:
+        """Compute the retention plan of a feed.
+
+        Args:
+            name (str): feed name, which is also the name of its release.
+            store (MetadataStore): metadata of the feed.
+            keep (int | None, optional): Maximum number of records. Defaults to None, which means no limit.
+            max_age (timedelta | None, optional): Maximum age of records. Defaults to None, which means no limit.
+            delete_orphans (bool, optional): Whether to remove media assets without any metadata record. Defaults to False.
+            orphan_grace (timedelta, optional): Orphan assets are removed after this time,
+                so files of an entry being published are never removed. Defaults to 1 day.
+            min_coverage (float, optional): Minimum ratio of metadata records to vids in the largest RSS feed. Defaults to 0.5.
+            pod_types (tuple[str, ...], optional): RSS feeds to trim. Defaults to ("audio", "video").
+
+        Raises:
+            RuntimeError: if the metadata is empty or has far fewer records than the RSS feeds.
+        """
+        self.name = name
+        self.store = store
+        self.pod_types = pod_types
+        rss_vids = max((len({guid_to_vid(x) for x in read_guids(self.xml_path(pod_type))}) for pod_type in pod_types), default=0)
+        if len(store) == 0 or len(store) < rss_vids * min_coverage:
+            raise RuntimeError(f"{name}: metadata has {len(store)} records but RSS feeds have {rss_vids} entries, refuse to clean up")
+        now = datetime.now(UTC)
+        cutoff = (now - max_age).timestamp() if max_age is not None else None
+
+        records = store.newest(limit=keep)
+        self.keep_vids = {x["vid"] for x in records if cutoff is None or (ts := get_timestamp(x)) is None or ts >= cutoff}
+        self.drop_vids = [x["vid"] for x in store if x["vid"] not in self.keep_vids]
+        known_vids = self.keep_vids | set(self.drop_vids)
+
+        self.drop_assets: dict[str, int] = {}  # asset name -> asset id
+        for asset_name, asset in gh.get_release_assets(name).items():
+            vid = asset_to_vid(asset_name, known_vids)
+            if vid is None or vid in self.keep_vids:
+                continue
+            updated = parse_date(asset["updated_at"])
+            if vid in known_vids or (delete_orphans and updated is not None and now - updated > orphan_grace):
+                self.drop_assets[asset_name] = asset["id"]
+
+        self.drop_items = {pod_type: trim_xml(self.xml_path(pod_type), accept=self.accept_guid, dry_run=True) for pod_type in pod_types}
+
+    def xml_path(self, pod_type: str) -> Path:
+        return Path(f"{pod_type}/{self.name}.xml")
+
+    def accept_guid(self, guid: str) -> bool:
+        return guid_to_vid(guid) in self.keep_vids
+
+    def report(self) -> None:
+        items = ", ".join(f"{n} {pod_type} items" for pod_type, n in self.drop_items.items())
+        logger.info(f"{self.name}: keep {len(self.keep_vids)} entries, remove {len(self.drop_vids)} entries, {items}, {len(self.drop_assets)} assets")
+        for asset_name in sorted(self.drop_assets):
+            logger.debug(f"{self.name}: remove asset {asset_name}")
+
+    def apply(self, metadata_path: str | Path, *, workers: int = 8) -> None:
+        """Remove expired records, RSS items and assets, and upload the changed files.
+
+        RSS feeds are uploaded before the metadata and assets are deleted last,
+        so a published item never points to a deleted asset.
+
+        Args:
+            metadata_path (str | Path): Path of the metadata json file of the feed.
+            workers (int, optional): Number of assets deleted at the same time. Defaults to 8.
+        """
+        for pod_type in self.pod_types:
+            if self.drop_items[pod_type] and trim_xml(self.xml_path(pod_type), accept=self.accept_guid):
+                gh.upload_release(self.xml_path(pod_type), pod_type)
+        if self.drop_vids:
+            self.store.remove(self.drop_vids)
+            self.store.export_json(metadata_path)
+            gh.upload_release(metadata_path, "metadata")
+        if self.drop_assets:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(gh.delete_asset, self.drop_assets.values()))
@@ -2,75 +2,188 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-import argparse
+import asyncio
 import os
-import sys
 from pathlib import Path
 
-import feedparser
+from cli import get_parser, run
+from dates import parse_date
+from deferred import DeferredEntries, deferred_path
+from feeds import FeedFetcher, bilibili_feed_url, bilibili_remote_vids, youtube_feed_url, youtube_remote_vids
 from github import gh
+from index import ProcessedIndex, index_path
 from loguru import logger
-from videogram.utils import load_json
-
-
-def main():
-    if not Path(args.config).exists():
-        return
-
-    if args.platform == "youtube":
-        check_youtube()
-    elif args.platform == "bilibili":
-        check_bilibili()
-    else:
-        raise NotImplementedError
-
-
-def check_youtube():
-    configs = load_json(args.config)
-    for conf in configs:
-        logger.info(f"Processing {conf['title']}")
-        database: list = load_json(f"{args.metadata_dir}/{conf['name']}.json", default=[])  # type: ignore
-        processed_vids = {x["vid"] for x in database}
-        remote = feedparser.parse(f"https://www.youtube.com/feeds/videos.xml?channel_id={conf['yt_channel']}")
-        remote_vids = {x["yt_videoid"] for x in remote["entries"]}
-        if remote_vids.issubset(processed_vids):
-            logger.info(f"No new videos found for {conf['title']}")
+from store import open_store
+from utils import load_json
+
+PLATFORMS = {
+    "youtube": (youtube_feed_url, youtube_remote_vids),
+    "bilibili": (bilibili_feed_url, bilibili_remote_vids),
+}
+
+
+async def main():
+    configs = args.config or [f"config/{platform}.json" for platform in args.platform]
+    if len(configs) != len(args.platform):
+        raise ValueError("Number of --config must match number of --platform")
+
+    fetcher = FeedFetcher(concurrency=args.concurrency, per_host=args.per_host, timeout=args.timeout)
+    tasks = []
+    indexes = []
+    for platform, config in zip(args.platform, configs, strict=True):
+        if platform not in PLATFORMS:
+            raise NotImplementedError
+        if not Path(config).exists():
             continue
-        logger.warning(f"New videos found for {conf['title']}, trigger an update.")
-        gh.trigger_workflow(conf["name"], platform="youtube")
+        index = open_index(platform)
+        if index is not None:
+            indexes.append(index)
+        tasks.extend(check_feed(fetcher, conf, platform, index) for conf in load_json(config))
+    try:
+        changed = [x for x in await asyncio.gather(*tasks) if x is not None]
+    finally:
+        for index in indexes:
+            index.close()
+    report(dispatch(changed))
+
+
+def get_active_feeds() -> tuple[set[tuple[str, str]], dict[str, list[str]]]:
+    """Get feeds of in-progress and pending single.yml runs, parsed from their run names.
+
+    The run name is "<platform> <names>", where names are separated by commas.
 
+    Returns:
+        tuple[set[tuple[str, str]], dict[str, list[str]]]: (platform, feed name) of in-progress runs,
+            and feed names of pending runs of each platform.
+    """
+    try:
+        runs = gh.get_active_runs("single.yml")
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Failed to list active runs, dispatch all changed feeds: {e}")
+        return set(), {}
+    running = set()
+    pending: dict[str, list[str]] = {}
+    for workflow_run in runs:
+        platform, _, names = workflow_run.get("display_title", "").partition(" ")
+        names = [x.strip() for x in names.split(",") if x.strip()]
+        if workflow_run["status"] == "in_progress":
+            running.update((platform, name) for name in names)
+        else:
+            pending.setdefault(platform, []).extend(names)
+    return running, pending
 
-def check_bilibili():
-    configs = load_json(args.config)
 
-    for conf in configs:
-        logger.info(f"Processing {conf['title']}")
-        database: list = load_json(f"{args.metadata_dir}/{conf['name']}.json", default=[])  # type: ignore
-        processed_vids = {x["vid"] for x in database}
-        remote = feedparser.parse(f"{os.getenv('RSSHUB_URL', 'https://rsshub.app')}/bilibili/user/video/{conf['uid']}")
-        remote_vids = {Path(x["link"]).stem for x in remote["entries"][:5]}
-        if remote_vids.issubset(processed_vids):
-            logger.info(f"No new videos found for {conf['title']}")
+def dispatch(changed: list[dict]) -> dict[str, int]:
+    """Trigger updates of changed feeds, with one run per platform.
+
+    single.yml runs in one concurrency group per platform, which holds a single pending run,
+    and a new dispatch cancels the pending one. So feeds are never dispatched one by one:
+
+    - Feeds with an in-progress run are skipped, since that run will process their new videos.
+    - Feeds that are all in the pending run of their platform are left to it.
+    - Otherwise, one run is dispatched with the changed feeds, from the largest backlog to the smallest,
+      then from the oldest pending video, followed by the feeds of the pending run it replaces.
+
+    Args:
+        changed (list[dict]): changed feeds, see `check_feed`.
+
+    Returns:
+        dict[str, int]: number of changed feeds, skipped feeds, dispatched runs, feeds coalesced into them,
+            and feeds merged from replaced pending runs.
+    """
+    counts = {"changed": len(changed), "skipped": 0, "dispatched": 0, "coalesced": 0, "merged": 0}
+    if not changed:
+        return counts
+    running, pending = get_active_feeds()
+    todo = []
+    for feed in changed:
+        if (feed["platform"], feed["name"]) in running or (feed["platform"], "all") in running:
+            logger.info(f"Skip {feed['name']}, an update is already running.")
+            counts["skipped"] += 1
+        else:
+            todo.append(feed)
+    todo.sort(key=lambda x: (-x["backlog"], x["oldest"]))
+
+    for platform in dict.fromkeys(x["platform"] for x in todo):
+        queued = pending.get(platform, [])
+        names = [x["name"] for x in todo if x["platform"] == platform]
+        if "all" in queued or set(names) <= set(queued):
+            logger.info(f"Skip {len(names)} {platform} feeds, an update of them is already queued.")
+            counts["skipped"] += len(names)
             continue
-        logger.warning(f"New videos found for {conf['title']}, trigger an update.")
-        gh.trigger_workflow(conf["name"], platform="bilibili")
+        merged = [x for x in dict.fromkeys(queued) if x not in names]
+        logger.warning(f"Trigger an update of {len(names)} {platform} feeds, and {len(merged)} feeds of the queued run it replaces.")
+        gh.trigger_workflow(",".join(names + merged), platform=platform)
+        counts["dispatched"] += 1
+        counts["coalesced"] += len(names) - 1
+        counts["merged"] += len(merged)
+    return counts
+
+
+def report(counts: dict[str, int]) -> None:
+    logger.info(
+        f"{counts['changed']} changed feeds: {counts['dispatched']} runs dispatched, "
+        f"{counts['coalesced']} coalesced, {counts['merged']} merged from queued runs, {counts['skipped']} skipped as already pending."
+    )
+    summary = os.getenv("GITHUB_STEP_SUMMARY")
+    if summary:
+        with open(summary, "a") as f:
+            f.write("| Changed feeds | Dispatched runs | Coalesced | Merged | Skipped |\n| --- | --- | --- | --- | --- |\n")
+            f.write(f"| {counts['changed']} | {counts['dispatched']} | {counts['coalesced']} | {counts['merged']} | {counts['skipped']} |\n")
+
+
+def open_index(platform: str) -> ProcessedIndex | None:
+    path = index_path(args.metadata_dir, platform)
+    if not path.exists():
+        logger.warning(f"No processed index of {platform}, fall back to metadata files.")
+        return None
+    return ProcessedIndex(path, readonly=True)
+
+
+def get_pending_vids(conf: dict, vids: set[str], index: ProcessedIndex | None) -> set[str]:
+    """Get vids of the remote feed that are neither processed nor deferred.
+
+    The processed index is used if it has the feed, otherwise the metadata files of the feed.
+    """
+    if index is not None and index.has_feed(conf["name"]):
+        return index.pending(conf["name"], vids)
+    json_path = f"{args.metadata_dir}/{conf['name']}.json"
+    store = open_store(json_path, backend="json")
+    deferred = DeferredEntries(deferred_path(json_path))
+    return {vid for vid in vids if vid not in store and deferred.is_due(vid)}
+
+
+async def check_feed(fetcher: FeedFetcher, conf: dict, platform: str, index: ProcessedIndex | None = None) -> dict | None:
+    """Check a feed for new videos.
+
+    Returns:
+        dict | None: platform, feed name, number of new videos and the POSIX timestamp of the oldest one,
+            or None if there are no new videos.
+    """
+    get_feed_url, get_remote_vids = PLATFORMS[platform]
+    remote = await fetcher.fetch(get_feed_url(conf))
+    logger.info(f"Processing {conf['title']}")
+    if remote is None:
+        logger.error(f"Skip {conf['title']}, feed is not available.")
+        return None
+    remote_vids = get_remote_vids(remote)
+    pending = get_pending_vids(conf, set(remote_vids), index)
+    if not pending:
+        logger.info(f"No new videos found for {conf['title']}")
+        return None
+    logger.warning(f"{len(pending)} new videos found for {conf['title']}")
+    published = [date.timestamp() for vid in pending if remote_vids[vid] and (date := parse_date(remote_vids[vid])) is not None]
+    return {"platform": platform, "name": conf["name"], "backlog": len(pending), "oldest": min(published, default=float("inf"))}
 
 
 if __name__ == "__main__":
     # parse arguments
-    parser = argparse.ArgumentParser(description="Sync YouTube to Telegram")
-    parser.add_argument("--log-level", type=str, default="INFO", required=False, help="Log level")
+    parser = get_parser("Sync YouTube to Telegram")
     parser.add_argument("--metadata-dir", type=str, default="metadata", required=False, help="Path to metadata directory.")
-    parser.add_argument("--config", type=str, default="config/youtube.json", required=False, help="Path to mapping json file.")
-    parser.add_argument("--platform", type=str, default="youtube", required=False, help="Social media platform.")
+    parser.add_argument("--config", type=str, nargs="+", required=False, help="Path to mapping json file of each platform. Defaults to config/<platform>.json")
+    parser.add_argument("--platform", type=str, nargs="+", default=["youtube"], required=False, help="Social media platforms.")
+    parser.add_argument("--concurrency", type=int, default=8, required=False, help="Maximum number of feeds fetched at the same time.")
+    parser.add_argument("--per-host", type=int, default=4, required=False, help="Maximum number of feeds fetched from the same host at the same time.")
+    parser.add_argument("--timeout", type=float, default=60, required=False, help="Timeout in seconds of fetching a single feed.")
     args = parser.parse_args()
-
-    # loguru settings
-    logger.remove()  # Remove default handler.
-    logger.add(
-        sys.stderr,
-        colorize=True,
-        level=args.log_level,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green>| <level>{level: <7}</level> | <cyan>{name: <10}</cyan>:<cyan>{function: ^30}</cyan>:<cyan>{line: >4}</cyan> - <level>{message}</level>",
-    )
-    main()
+    run(main, args)
@@ -0,0 +1,254 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from loguru import logger
+from utils import CACHE_DIR, load_json, save_json
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+
+def get_timestamp(record: dict) -> float | None:
+    """Get the POSIX timestamp of a metadata record from its "time" field, which is in RFC 822 format."""
+    try:
+        return parsedate_to_datetime(record["time"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class MetadataStore:
+    """Processed entries of a feed.
+
+    Records are dictionaries with at least a "vid" key, and they are ordered from the newest inserted to the oldest,
+    which is the same order as ``metadata/<name>.json``.
+    """
+
+    def __contains__(self, vid: str) -> bool:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self.newest())
+
+    def get(self, vid: str) -> dict | None:
+        raise NotImplementedError
+
+    def add(self, record: dict) -> None:
+        """Insert a record, or replace the record with the same vid in place."""
+        raise NotImplementedError
+
+    def remove(self, vids: Iterable[str]) -> None:
+        raise NotImplementedError
+
+    def newest(self, limit: int | None = None, offset: int = 0) -> list[dict]:
+        """Get records from the newest inserted to the oldest.
+
+        Args:
+            limit (int | None, optional): Maximum number of records. Defaults to None, which means no limit.
+            offset (int, optional): Number of newest records to skip. Defaults to 0.
+
+        Returns:
+            list[dict]: metadata records.
+        """
+        raise NotImplementedError
+
+    def between(self, start: datetime | None = None, end: datetime | None = None) -> list[dict]:
+        """Get records published in [start, end), from the newest to the oldest.
+
+        Records without a valid "time" field are never returned.
+        """
+        raise NotImplementedError
+
+    def trim(self, keep: int) -> list[dict]:
+        """Remove all but the newest ``keep`` records.
+
+        Returns:
+            list[dict]: removed records.
+        """
+        removed = self.newest(offset=keep)
+        self.remove(x["vid"] for x in removed)
+        return removed
+
+    def import_json(self, path: str | Path) -> None:
+        """Replace all records with the records of a metadata json file."""
+        raise NotImplementedError
+
+    def export_json(self, path: str | Path) -> None:
+        """Save all records to a metadata json file."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        save_json(self.newest(), path)
+
+    def close(self) -> None:
+        pass
+
+
+class JsonStore(MetadataStore):
+    """In-memory store loaded from a metadata json file."""
+
+    def __init__(self, path: str | Path | None = None) -> None:
+        self.records: dict[str, dict] = {}  # from the oldest to the newest, so that inserting is appending.
+        if path is not None:
+            self.import_json(path)
+
+    def __contains__(self, vid: str) -> bool:
+        return vid in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def get(self, vid: str) -> dict | None:
+        return self.records.get(vid)
+
+    def add(self, record: dict) -> None:
+        self.records[record["vid"]] = record
+
+    def remove(self, vids: Iterable[str]) -> None:
+        for vid in vids:
+            self.records.pop(vid, None)
+
+    def newest(self, limit: int | None = None, offset: int = 0) -> list[dict]:
+        records = list(reversed(self.records.values()))
+        return records[offset:] if limit is None else records[offset : offset + limit]
+
+    def between(self, start: datetime | None = None, end: datetime | None = None) -> list[dict]:
+        low = start.timestamp() if start else float("-inf")
+        high = end.timestamp() if end else float("inf")
+        matched = [(ts, x) for x in self.records.values() if (ts := get_timestamp(x)) is not None and low <= ts < high]
+        return [x for _, x in sorted(matched, key=lambda x: x[0], reverse=True)]
+
+    def import_json(self, path: str | Path) -> None:
+        records: list[dict] = load_json(Path(path).as_posix(), default=[])  # type: ignore
+        self.records = {x["vid"]: x for x in reversed(records)}
+
+
+class SQLiteStore(MetadataStore):
+    """Indexed store in a SQLite database.
+
+    Membership tests use the primary key, inserting never rewrites other records,
+    and publish times are indexed for retention queries.
+    """
+
+    def __init__(self, path: str | Path = ":memory:") -> None:
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                vid TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                ts REAL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_seq ON entries (seq);
+            CREATE INDEX IF NOT EXISTS entries_ts ON entries (ts);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+
+    def __contains__(self, vid: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM entries WHERE vid = ?", (vid,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, vid: str) -> dict | None:
+        row = self.conn.execute("SELECT data FROM entries WHERE vid = ?", (vid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, record: dict) -> None:
+        with self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO entries (vid, seq, ts, data)
+                VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM entries), ?, ?)
+                ON CONFLICT (vid) DO UPDATE SET ts = excluded.ts, data = excluded.data
+                """,
+                (record["vid"], get_timestamp(record), json.dumps(record, ensure_ascii=False)),
+            )
+
+    def remove(self, vids: Iterable[str]) -> None:
+        with self.conn:
+            self.conn.executemany("DELETE FROM entries WHERE vid = ?", ((vid,) for vid in vids))
+
+    def newest(self, limit: int | None = None, offset: int = 0) -> list[dict]:
+        rows = self.conn.execute("SELECT data FROM entries ORDER BY seq DESC LIMIT ? OFFSET ?", (-1 if limit is None else limit, offset))
+        return [json.loads(row[0]) for row in rows]
+
+    def between(self, start: datetime | None = None, end: datetime | None = None) -> list[dict]:
+        rows = self.conn.execute(
+            "SELECT data FROM entries WHERE ts >= ? AND ts < ? ORDER BY ts DESC",
+            (start.timestamp() if start else float("-inf"), end.timestamp() if end else float("inf")),
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def import_json(self, path: str | Path) -> None:
+        records: list[dict] = load_json(Path(path).as_posix(), default=[])  # type: ignore
+        with self.conn:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO entries (vid, seq, ts, data) VALUES (?, ?, ?, ?)",
+                ((x["vid"], len(records) - idx, get_timestamp(x), json.dumps(x, ensure_ascii=False)) for idx, x in enumerate(records)),
+            )
+        self._mark_synced(path)
+
+    def export_json(self, path: str | Path) -> None:
+        super().export_json(path)
+        self._mark_synced(path)
+
+    def is_synced(self, path: str | Path) -> bool:
+        """Whether the database has the same content as the json file, which is checked by its path and modification time."""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'synced_json'").fetchone()
+        return Path(path).exists() and row is not None and row[0] == self._json_version(path)
+
+    @staticmethod
+    def _json_version(path: str | Path) -> str:
+        path = Path(path).resolve()
+        return f"{path.as_posix()}:{path.stat().st_mtime_ns}"
+
+    def _mark_synced(self, path: str | Path) -> None:
+        if not Path(path).exists():
+            return
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced_json', ?)", (self._json_version(path),))
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def open_store(json_path: str | Path, backend: str = os.getenv("PODSYNC_METADATA_STORE", "sqlite")) -> MetadataStore:
+    """Open the metadata store of a feed.
+
+    The json file is always the source of truth, because it is what we publish to the ``metadata`` release.
+    The SQLite database is kept in the cache directory and re-imported whenever the json file changes.
+
+    Args:
+        json_path (str | Path): Path of the metadata json file, e.g. metadata/<name>.json
+        backend (str, optional): "sqlite" or "json". Defaults to the PODSYNC_METADATA_STORE environment variable or "sqlite".
+
+    Returns:
+        MetadataStore: metadata store of the feed.
+    """
+    json_path = Path(json_path)
+    if backend == "json":
+        return JsonStore(json_path)
+    if backend != "sqlite":
+        raise ValueError(f"Unknown metadata store: {backend}")
+
+    store = SQLiteStore(CACHE_DIR / "metadata" / f"{json_path.stem}.sqlite")
+    if not store.is_synced(json_path):
+        logger.debug(f"Importing {json_path} to {store.path}")
+        store.import_json(json_path)
+    return store
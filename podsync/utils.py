@@ -2,11 +2,41 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import json
+import mmap
+import os
 from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO
+from xml.sax.saxutils import unescape
 
 import xmltodict
 from loguru import logger
 
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable, Iterator
+
+CACHE_DIR = Path(os.getenv("PODSYNC_CACHE_DIR", ".cache"))
+
+
+def load_json(path: str | Path, default: dict | list | None = None) -> dict | list:
+    path = Path(path)
+    if not path.exists() and default is not None:
+        return default
+    with path.open() as f:
+        return json.load(f)
+
+
+def save_json(data: dict | list, path: str | Path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def delete_files(paths: Iterable[str | Path]):
+    for path in paths:
+        Path(path).unlink(missing_ok=True)
+
 
 def load_xml(path: str | Path, template: str = "rss") -> dict:
     path = Path(path)
@@ -30,3 +60,162 @@ def save_xml(header: dict, items: list[dict], save_path: str | Path):
     save_path.parent.mkdir(parents=True, exist_ok=True)
     with save_path.open("w") as f:
         f.write(xml_str)
+
+
+def _line_start(data: bytes | mmap.mmap, pos: int) -> int:
+    """Move pos back over the indentation before it."""
+    while pos > 0 and data[pos - 1 : pos] in {b" ", b"\t"}:
+        pos -= 1
+    return pos
+
+
+def iter_item_spans(data: bytes | mmap.mmap) -> Iterator[tuple[int, int]]:
+    """Yield byte ranges of <item> elements in an RSS file, including their indentation and trailing newline.
+
+    RSS files are written by xmltodict, which escapes "<" in text, so a literal "<item>" is always an element.
+    """
+    pos = data.find(b"<item>")
+    while pos != -1:
+        end = data.find(b"</item>", pos)
+        if end == -1:
+            return
+        end += len(b"</item>")
+        if data[end : end + 1] == b"\n":
+            end += 1
+        yield _line_start(data, pos), end
+        pos = data.find(b"<item>", end)
+
+
+def get_item_guid(data: bytes | mmap.mmap, start: int, end: int) -> str:
+    """Get the guid of the <item> element in data[start:end] without parsing it."""
+    pos = data.find(b"<guid", start, end)
+    if pos == -1:
+        return ""
+    pos = data.find(b">", pos, end) + 1
+    guid_end = data.find(b"</guid>", pos, end)
+    return unescape(data[pos:guid_end].decode())
+
+
+def get_item_enclosure(data: bytes | mmap.mmap, start: int, end: int) -> str:
+    """Get the enclosure url of the <item> element in data[start:end] without parsing it."""
+    pos = data.find(b"<enclosure", start, end)
+    if pos == -1:
+        return ""
+    tag_end = data.find(b">", pos, end)
+    pos = data.find(b' url="', pos, tag_end)
+    if pos == -1:
+        return ""
+    pos += len(b' url="')
+    return unescape(data[pos : data.find(b'"', pos, tag_end)].decode(), {"&quot;": '"'})
+
+
+def item_key(item: dict) -> tuple[str, str]:
+    """Identity of a rendered podcast item, see `_copy_items`."""
+    enclosure = item.get("enclosure") or {}
+    return item["guid"], str(enclosure.get("@url", ""))
+
+
+def _copy_items(
+    data: bytes | mmap.mmap,
+    f: BinaryIO | None,
+    seen: set[tuple[str, str]],
+    keep: int | None = None,
+    accept: Callable[[str], bool] | None = None,
+) -> tuple[int, int]:
+    """Copy <item> elements to f in one pass, using seen as the index of (guid, enclosure url).
+
+    Items are identified by guid and enclosure url together, since older feeds gave every part of a split video
+    the same guid. Items already in seen, or whose guid is rejected by accept, are dropped,
+    and copying stops once seen has keep items. Nothing is written if f is None.
+
+    Returns:
+        tuple[int, int]: number of dropped items, and the end offset of the last item in data.
+    """
+    dropped = 0
+    last_end = 0
+    for start, end in iter_item_spans(data):
+        last_end = end
+        guid = get_item_guid(data, start, end)
+        key = (guid, get_item_enclosure(data, start, end))
+        if key in seen or (keep is not None and len(seen) >= keep) or (accept is not None and not accept(guid)):
+            dropped += 1
+            continue
+        seen.add(key)
+        if f is not None:
+            f.write(data[start:end])
+    return dropped, last_end
+
+
+def splice_xml(header: dict, items: list[dict], save_path: str | Path, keep: int | None = None):
+    """Add new items to the front of an RSS file without parsing the existing items.
+
+    The channel header and the new items are rendered by xmltodict, then the existing <item> elements are
+    copied byte-for-byte from the old file. The result is the same as `save_xml` with the new items followed by
+    the existing items, but the cost is proportional to the new items instead of the whole feed.
+
+    Inserting is an upsert by guid and enclosure url: an existing item with the same guid and enclosure url
+    as a new item, or as a newer existing item, is dropped. Trimming to the newest ``keep`` items happens in the same pass.
+
+    Args:
+        header (dict): RSS header, whose "item" will be replaced by the new items.
+        items (list[dict]): new items, from the latest to the oldest.
+        save_path (str | Path): path of the RSS file.
+        keep (int | None, optional): maximum number of items in the feed. Defaults to None, which means no limit.
+    """
+    seen: set[tuple[str, str]] = set()
+    new_items = []
+    for item in items:
+        if item_key(item) not in seen and (keep is None or len(seen) < keep):
+            seen.add(item_key(item))
+            new_items.append(item)
+    header["rss"]["channel"]["item"] = new_items
+    rendered = xmltodict.unparse(header, pretty=True, full_document=True).encode()
+    channel_end = _line_start(rendered, rendered.rfind(b"</channel>"))
+
+    save_path = Path(save_path)
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = save_path.with_suffix(".tmp")
+    with tmp_path.open("wb") as f:
+        f.write(rendered[:channel_end])
+        if save_path.exists() and save_path.stat().st_size > 0:
+            logger.debug(f"Copying existing items from {save_path.as_posix()}")
+            with save_path.open("rb") as old, mmap.mmap(old.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                _copy_items(data, f, seen, keep)
+        f.write(rendered[channel_end:])
+    tmp_path.replace(save_path)
+
+
+def trim_xml(path: str | Path, keep: int | None = None, accept: Callable[[str], bool] | None = None, *, dry_run: bool = False) -> int:
+    """Remove duplicated items, items beyond the newest ``keep`` and items rejected by ``accept`` from an RSS file in one pass.
+
+    Everything except the dropped <item> elements is copied byte-for-byte, and the file is only rewritten if
+    some items are dropped.
+
+    Args:
+        path (str | Path): path of the RSS file.
+        keep (int | None, optional): maximum number of items in the feed. Defaults to None, which means no limit.
+        accept (Callable[[str], bool] | None, optional): whether to keep the item with a guid. Defaults to None, which keeps all items.
+        dry_run (bool, optional): only count the items to drop, without rewriting the file. Defaults to False.
+
+    Returns:
+        int: number of dropped items.
+    """
+    path = Path(path)
+    if not path.exists() or path.stat().st_size == 0:
+        return 0
+    with path.open("rb") as old, mmap.mmap(old.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        first = data.find(b"<item>")
+        if first == -1:
+            return 0
+        if dry_run:
+            return _copy_items(data, None, set(), keep, accept)[0]
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("wb") as f:
+            f.write(data[: _line_start(data, first)])
+            dropped, last_end = _copy_items(data, f, set(), keep, accept)
+            f.write(data[last_end:])
+    if dropped == 0:
+        tmp_path.unlink()
+        return 0
+    tmp_path.replace(path)
+    return dropped
@@ -2,23 +2,59 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-import argparse
 import asyncio
-import os
+import signal
 import sys
+from datetime import UTC, datetime
 from pathlib import Path
 
-import dateparser
-import feedparser
-from base import PodSync
+from base import PodSync, select_feeds
+from cli import get_parser, run
+from dates import format_date, parse_pub_date
+from extraction import extract_flat, extractor
+from feeds import FeedFetcher, youtube_feed_url
 from loguru import logger
-from videogram.utils import delete_files, load_json
-from videogram.ytdlp import ytdlp_extract_info
+from metrics import metrics
+from utils import load_json
 
 
 class YouTube(PodSync):
-    def __init__(self, name: str, config: dict, database_path: Path) -> None:
-        super().__init__(name, config, database_path)
+    platform = "youtube"
+
+    def __init__(self, name: str, config: dict, database_path: Path, **kwargs) -> None:
+        super().__init__(name, config, database_path, **kwargs)
+
+    def get_vid(self, entry: dict) -> str:
+        return entry["yt_videoid"]
+
+    def get_cover(self, entry: dict) -> str:
+        return entry["media_thumbnail"][0]["url"]
+
+    def prefetch(self, entries: list[dict]) -> None:
+        """Find the new shorts in the flat listing of the shorts tab of the channel, if shorts are skipped.
+
+        A flat entry can only save the full extraction of a skipped short, since other videos are extracted anyway
+        to check their availability before downloading, see `check_entry`. So nothing is listed unless shorts are skipped,
+        and a single listing of the shorts tab is enough. Shorts that are missing from the listing are still found
+        by their duration after the full extraction.
+
+        Flat entries are cached separately from full extractions, with ``flat=True``, since the listing has no availability.
+        """
+        if not self.config["skip_shorts"]:
+            return
+        wanted = {x["yt_videoid"]: x for x in entries}
+        found = 0
+        for info in extract_flat(f"https://www.youtube.com/channel/{self.config['yt_channel']}/shorts", limit=len(entries) + 15):
+            entry = wanted.pop(info.get("id"), None)
+            if entry is not None:
+                extractor.put(entry["link"], {**info, "shorts": True}, flat=True)
+                found += 1
+        logger.info(f"Prefetched {found} of {len(entries)} new videos from the shorts of the channel")
+
+    @staticmethod
+    def is_shorts(info: dict) -> bool:
+        # Entries of the shorts tab are marked by `prefetch`, fully extracted videos are shorts if they are at most 60 seconds long.
+        return bool(info.get("shorts")) or info["duration"] <= 60
 
     def check_entry(self, entry: dict) -> dict:
         """Check if the entry is valid for download.
@@ -47,15 +83,24 @@ class YouTube(PodSync):
             "metadata": {},
             "need_download": False,
         }
-        info = ytdlp_extract_info(entry["link"], playlist=False, process=False)[0]
+        # A prefetched flat entry can only skip the full extraction of skipped shorts,
+        # downloadable videos are extracted to check their availability.
+        info = extractor.get(entry["link"], flat=True)
+        if info is None or not (self.config["skip_shorts"] and self.is_shorts(info)):
+            info = extractor.extract_info(entry["link"], process=False)
         if info.get("live_status") in {"is_upcoming", "is_live", "post_live"}:
             logger.warning(f"Skip not finished video: {entry['title']}")
+            premiere = info.get("release_timestamp") if info["live_status"] == "is_upcoming" else None
+            res["defer"] = {
+                "reason": info["live_status"],
+                "retry_at": datetime.fromtimestamp(premiere, tz=UTC) if premiere else None,
+            }
             return res
 
         # log metadata
-        video_is_short = info["duration"] <= 60  # YouTube Shorts can be a maximum of 60 seconds long.
-        publish_time = dateparser.parse(entry["published"], settings={"TO_TIMEZONE": os.getenv("TZ", "UTC")})
-        res["metadata"] = {"title": entry["title"], "vid": entry["yt_videoid"], "shorts": video_is_short, "time": f"{publish_time:%a, %d %b %Y %H:%M:%S %z}"}
+        video_is_short = self.is_shorts(info)
+        publish_time = parse_pub_date(entry["published"])
+        res["metadata"] = {"title": entry["title"], "vid": entry["yt_videoid"], "shorts": video_is_short, "time": format_date(publish_time)}
         res["need_update_database"] = True
 
         # skip banned video
@@ -73,70 +118,93 @@ class YouTube(PodSync):
         return res
 
 
-async def main():
-    logger.info(f"Processing {args.name}")
+async def sync_feed(conf: dict, fetcher: FeedFetcher) -> None:
+    logger.info(f"Processing {conf['name']}")
 
     # initialize youtube
-    conf: dict = next(x for x in load_json(args.config) if x["name"] == args.name)
-    youtube = YouTube(args.name, conf, Path(args.metadata_dir) / f"{args.name}.json")
+    youtube = YouTube(
+        conf["name"],
+        conf,
+        Path(args.metadata_dir) / f"{conf['name']}.json",
+        checkpoint_entries=args.checkpoint_entries,
+        checkpoint_seconds=args.checkpoint_seconds,
+        keep_items=args.keep,
+        download_workers=args.download_workers,
+        batch_threshold=args.batch_threshold,
+    )
+    if args.recover_only:
+        youtube.flush()
+        return
     # process feed
-    processed_vids = {x["vid"] for x in youtube.database}
-    remote = feedparser.parse(f"https://www.youtube.com/feeds/videos.xml?channel_id={conf['yt_channel']}")
-    for entry in remote["entries"][::-1]:  # from oldest to latest
-        if entry["yt_videoid"] in processed_vids:
-            logger.debug(f"Skip processed: {entry['title']}")
-            continue
-        logger.info(f"New video found: [{entry['yt_videoid']}] {entry['title']}")
-
-        res = await youtube.process_single_entry(entry, use_cookie=False)
-        # Update
-        youtube.update_database(res["entry_info"])
-        if not res["download_info"]:
-            continue
-
-        # audio
-        if not conf.get("skip_audio", False):
-            youtube.upload_files("audio", res["download_info"]["audio_info"], entry["yt_videoid"])
-            audio_items = youtube.get_pod_items(
-                pod_type="audio",
-                info_list=res["download_info"]["audio_info"],
-                vid=entry["yt_videoid"],
-                entry=entry,
-                cover=entry["media_thumbnail"][0]["url"],
-            )
-            youtube.update_pod_rss("audio", audio_items, feed=remote["feed"])
-
-        # video
-        if not conf.get("skip_video", False):
-            youtube.upload_files("video", res["download_info"]["video_info"], entry["yt_videoid"])
-            video_items = youtube.get_pod_items(
-                pod_type="video",
-                info_list=res["download_info"]["video_info"],
-                vid=entry["yt_videoid"],
-                entry=entry,
-                cover=entry["media_thumbnail"][0]["url"],
-            )
-            youtube.update_pod_rss("video", video_items, feed=remote["feed"])
-        # Cleanup
-        prefix = entry["title"][:60]
-        delete_files(Path(".").glob(f"{prefix}.*"))
+    try:
+        with metrics.span("feed_fetch", conf["name"]):
+            remote = await fetcher.fetch(youtube_feed_url(conf))
+        if remote is None:
+            logger.error(f"Feed of {conf['name']} is not available.")
+            return
+        youtube.deferred.prune(entry["yt_videoid"] for entry in remote["entries"])
+        new_entries = []
+        for entry in remote["entries"][::-1]:  # from oldest to latest
+            if youtube.is_processed(entry["yt_videoid"]):
+                logger.debug(f"Skip processed: {entry['title']}")
+                continue
+            if youtube.is_deferred(entry["yt_videoid"]):
+                logger.debug(f"Skip deferred: {entry['title']}")
+                continue
+            logger.info(f"New video found: [{entry['yt_videoid']}] {entry['title']}")
+            new_entries.append(entry)
+
+        await youtube.run_pipeline(
+            new_entries,
+            remote["feed"],
+            use_cookie=False,
+            download_concurrency=args.download_concurrency,
+            upload_concurrency=args.upload_concurrency,
+            queue_size=args.queue_size,
+            min_free_space=int(args.min_free_space * 1024**3),
+        )
+    finally:
+        youtube.flush()
+
+
+async def main():
+    confs = select_feeds(load_json(args.config), args.name)  # type: ignore
+    fetcher = FeedFetcher()
+    semaphore = asyncio.Semaphore(args.feed_concurrency)
+
+    async def sync_limited(conf: dict) -> None:
+        async with semaphore:
+            await sync_feed(conf, fetcher)
+
+    results = await asyncio.gather(*(sync_limited(conf) for conf in confs), return_exceptions=True)
+    failed = []
+    for conf, res in zip(confs, results, strict=True):
+        if isinstance(res, BaseException):
+            logger.opt(exception=res).error(f"Failed to sync {conf['name']}")
+            failed.append(conf["name"])
+    if failed:
+        raise RuntimeError(f"Failed to sync {len(failed)} of {len(confs)} feeds: {', '.join(failed)}")
 
 
 if __name__ == "__main__":
     # parse arguments
-    parser = argparse.ArgumentParser(description="Sync YouTube to Telegram")
-    parser.add_argument("--log-level", type=str, default="INFO", required=False, help="Log level")
+    parser = get_parser("Sync YouTube to Telegram")
     parser.add_argument("--config", type=str, default="config/youtube.json", required=False, help="Path to configuration json file.")
     parser.add_argument("--metadata-dir", type=str, default="metadata", required=False, help="Path to metadata directory.")
-    parser.add_argument("--name", type=str, required=True, help="Feed name.")
+    parser.add_argument("--name", type=str, nargs="+", required=True, help='Feed names, also separated by commas, or "all" for every feed in the config.')
+    parser.add_argument("--feed-concurrency", type=int, default=1, required=False, help="How many feeds to sync at the same time.")
+    parser.add_argument("--checkpoint-entries", type=int, default=5, required=False, help="Upload database and RSS changes after this number of entries.")
+    parser.add_argument("--checkpoint-seconds", type=float, default=600, required=False, help="Upload database and RSS changes at least every this number of seconds.")
+    parser.add_argument("--keep", type=int, default=None, required=False, help="How many items to keep in RSS feeds.")
+    parser.add_argument("--download-concurrency", type=int, default=1, required=False, help="How many new entries to download at the same time.")
+    parser.add_argument("--upload-concurrency", type=int, default=1, required=False, help="How many downloaded entries to upload at the same time.")
+    parser.add_argument("--queue-size", type=int, default=2, required=False, help="How many downloaded entries can wait for upload.")
+    parser.add_argument("--min-free-space", type=float, default=2, required=False, help="Minimum free disk space in GiB to start a new download.")
+    parser.add_argument("--download-workers", type=int, default=2, required=False, help="Number of threads for extraction and download.")
+    parser.add_argument("--batch-threshold", type=int, default=3, required=False, help="Prefetch video info in a batch if there are at least this number of new entries.")
+    parser.add_argument("--recover-only", action="store_true", help="Only upload unsaved changes of a killed run.")
     args = parser.parse_args()
 
-    # loguru settings
-    logger.remove()  # Remove default handler.
-    logger.add(
-        sys.stderr,
-        colorize=True,
-        level=args.log_level,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green>| <level>{level: <7}</level> | <cyan>{name: <10}</cyan>:<cyan>{function: ^30}</cyan>:<cyan>{line: >4}</cyan> - <level>{message}</level>",
-    )
-    asyncio.run(main())
+    # Exit gracefully on SIGTERM (e.g. job timeout), so buffered changes are flushed.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(143))
+    run(main, args)
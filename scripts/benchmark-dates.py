@@ -0,0 +1,40 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of feed date parsing: dateparser vs podsync.dates (uncached and memoized).
+
+Usage: PYTHONPATH=. python scripts/benchmark-dates.py
+"""
+
+import argparse
+import os
+import timeit
+
+import dateparser
+
+from podsync.dates import _parse_date, format_date, parse_date
+
+SAMPLES = {
+    "youtube (ISO 8601)": "2024-05-06T10:00:00+00:00",
+    "rsshub (RFC 822)": "Mon, 06 May 2024 10:00:00 GMT",
+    "fallback (naive)": "2024-05-06 10:00:00",
+}
+
+
+def main():
+    tz = os.getenv("TZ", "UTC")
+    print(f"{'input':<20} {'dateparser':>12} {'uncached':>12} {'memoized':>12}")
+    for name, text in SAMPLES.items():
+        expected = dateparser.parse(text, settings={"TO_TIMEZONE": tz})
+        assert format_date(parse_date(text)) == format_date(expected), f"Mismatch of {name}: {parse_date(text)} != {expected}"  # type: ignore
+
+        baseline = timeit.timeit(lambda t=text: dateparser.parse(t, settings={"TO_TIMEZONE": tz}), number=args.number) / args.number
+        uncached = timeit.timeit(lambda t=text: _parse_date.__wrapped__(t, tz), number=args.number) / args.number
+        memoized = timeit.timeit(lambda t=text: parse_date(t), number=args.number) / args.number
+        print(f"{name:<20} {baseline * 1e6:>10.1f}us {uncached * 1e6:>10.1f}us {memoized * 1e6:>10.1f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark date parsing of feed timestamps")
+    parser.add_argument("-n", "--number", type=int, default=1000, required=False, help="Number of calls per measurement")
+    args = parser.parse_args()
+    main()
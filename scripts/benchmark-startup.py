@@ -0,0 +1,65 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measure import time of the entry points with `python -X importtime`.
+
+Each entry point is started with --help, so only module loading and argument parsing are measured.
+GITHUB_TOKEN is removed from the environment to make sure that nothing talks to GitHub at import time.
+Exit with status 1 if an entry point fails to start or exceeds the budget.
+
+Usage: python scripts/benchmark-startup.py --budget 1.5
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ENTRY_POINTS = ["scheduler.py", "youtube.py", "bilibili.py", "clean-up.py", "refresh-opml.py"]
+
+
+def measure(script: Path) -> tuple[float, float, list[tuple[int, str]]]:
+    env = {k: v for k, v in os.environ.items() if k != "GITHUB_TOKEN"}
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", script.as_posix(), "--help"], capture_output=True, text=True, env=env, check=False)  # noqa: S603
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{script.name} failed to start:\n{proc.stderr[-2000:]}")
+
+    total_us = 0
+    top_level = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line.removeprefix("import time:").split("|")
+        total_us += int(self_us)
+        if not module.startswith("  "):  # modules imported directly by the entry point have one space of indentation
+            top_level.append((int(cumulative_us), module.strip()))
+    return wall, total_us / 1e6, sorted(top_level, reverse=True)[: args.top]
+
+
+def main():
+    failed = False
+    for name in ENTRY_POINTS:
+        try:
+            wall, imports, top = measure(Path(args.source_dir) / name)
+        except RuntimeError as e:
+            print(e)
+            failed = True
+            continue
+        status = "OK" if args.budget is None or imports <= args.budget else "OVER BUDGET"
+        failed = failed or status != "OK"
+        print(f"{name:<16} wall {wall:.3f}s, imports {imports:.3f}s [{status}]")
+        for cumulative_us, module in top:
+            print(f"    {cumulative_us / 1e6:.3f}s {module}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark startup time of entry points")
+    parser.add_argument("--source-dir", type=str, default="podsync", required=False, help="Directory of the entry points.")
+    parser.add_argument("--budget", type=float, default=None, required=False, help="Maximum import time in seconds of each entry point.")
+    parser.add_argument("--top", type=int, default=5, required=False, help="Number of slowest top-level imports to show.")
+    args = parser.parse_args()
+    main()
@@ -1,10 +1,12 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
+import sys
 from pathlib import Path
 
-from videogram.utils import load_json, save_json
+sys.path.insert(0, Path(__file__).resolve().parents[1].joinpath("podsync").as_posix())
 
-from podsync.github import gh
+from github import gh  # noqa: E402
+from utils import load_json, save_json  # noqa: E402
 
 config_path = Path("config/bilibili.json")
 
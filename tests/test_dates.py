@@ -0,0 +1,31 @@
+from datetime import UTC, datetime, timedelta
+
+import dateparser
+import pytest
+from dates import format_date, parse_date, parse_pub_date
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "2024-05-06T10:00:00+00:00",  # YouTube
+        "2024-05-06T18:30:00+08:00",
+        "Mon, 06 May 2024 10:00:00 GMT",  # RSSHub
+        "Mon, 06 May 2024 10:00:00 +0800",
+        "2024-05-06 10:00:00",  # naive, parsed by dateparser
+    ],
+)
+@pytest.mark.parametrize("tz", ["UTC", "Asia/Shanghai"])
+def test_parse_date_matches_dateparser(text, tz):
+    expected = dateparser.parse(text, settings={"TO_TIMEZONE": tz})
+    assert parse_date(text, tz) == expected
+    assert format_date(parse_date(text, tz)) == format_date(expected)
+
+
+def test_parse_date_invalid():
+    assert parse_date("not a date") is None
+
+
+def test_parse_pub_date_falls_back_to_now():
+    assert parse_pub_date("Mon, 06 May 2024 10:00:00 GMT") == datetime(2024, 5, 6, 10, tzinfo=UTC)
+    assert datetime.now(UTC) - parse_pub_date("not a date") < timedelta(seconds=5)
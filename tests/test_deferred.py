@@ -0,0 +1,49 @@
+from datetime import UTC, datetime, timedelta
+
+from deferred import DeferredEntries, deferred_path
+
+
+def test_deferred_path():
+    assert deferred_path("metadata/feed.json").as_posix() == "metadata/feed-deferred.json"
+
+
+def test_backoff(tmp_path):
+    deferred = DeferredEntries(tmp_path / "feed-deferred.json", base_delay=timedelta(hours=1), max_delay=timedelta(hours=3))
+    now = datetime.now(UTC)
+    assert deferred.is_due("a")
+
+    for hours in (1, 2, 3, 3):
+        deferred.defer("a", "ExtractorError")
+        assert not deferred.is_due("a", now + timedelta(hours=hours) - timedelta(minutes=1))
+        assert deferred.is_due("a", now + timedelta(hours=hours, minutes=1))
+    assert deferred.entries["a"]["attempts"] == 4
+
+
+def test_retry_at_premiere(tmp_path):
+    deferred = DeferredEntries(tmp_path / "feed-deferred.json")
+    premiere = datetime.now(UTC) + timedelta(days=3)
+    deferred.defer("a", "is_upcoming", retry_at=premiere)
+    assert not deferred.is_due("a", premiere - timedelta(minutes=1))
+    assert deferred.is_due("a", premiere)
+
+    # a premiere in the past falls back to the backoff
+    deferred.defer("b", "is_upcoming", retry_at=datetime.now(UTC) - timedelta(hours=1))
+    assert not deferred.is_due("b")
+
+
+def test_prune_and_save(tmp_path):
+    path = tmp_path / "feed-deferred.json"
+    deferred = DeferredEntries(path)
+    assert not deferred.save()
+    deferred.defer("a", "is_live")
+    deferred.defer("b", "is_live")
+    deferred.prune(["b", "c"])
+    assert "a" not in deferred
+    assert "b" in deferred
+    assert deferred.save()
+    assert not deferred.save()
+
+    loaded = DeferredEntries(path)
+    assert list(loaded.entries) == ["b"]
+    loaded.resolve("b")
+    assert loaded.changed
@@ -0,0 +1,60 @@
+import asyncio
+
+import feedparser
+from feeds import FeedCache, FeedFetcher
+
+URL = "https://rsshub.example.com/bilibili/user/video/1"
+BODY = b"""<?xml version="1.0"?><rss version="2.0"><channel><title>feed</title>
+<item><title>video</title><link>https://www.bilibili.com/video/BV1xx</link></item></channel></rss>"""
+
+
+class Response:
+    def __init__(self, status_code: int, content: bytes = b"", headers: dict | None = None) -> None:
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+class Session:
+    def __init__(self, *responses: Response) -> None:
+        self.responses = list(responses)
+        self.headers: list[dict] = []
+
+    def get(self, url: str, headers: dict, timeout: float) -> Response:
+        self.headers.append(headers)
+        return self.responses.pop(0)
+
+
+def test_conditional_get(tmp_path, monkeypatch):
+    parsed = []
+    parse = feedparser.parse
+    monkeypatch.setattr(feedparser, "parse", lambda data: parsed.append(data) or parse(data))
+    fetcher = FeedFetcher(cache=FeedCache(tmp_path))
+    fetcher.session = Session(
+        Response(200, BODY, {"ETag": '"v1"', "Last-Modified": "Mon, 06 May 2024 10:00:00 GMT"}),
+        Response(304),
+        Response(200, BODY),  # identical body without validators
+    )
+
+    feed = asyncio.run(fetcher.fetch(URL))
+    assert feed is not None
+    assert feed["entries"][0]["title"] == "video"
+    assert fetcher.session.headers[0] == {}
+
+    assert asyncio.run(fetcher.fetch(URL)) == feed
+    assert fetcher.session.headers[1] == {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 06 May 2024 10:00:00 GMT"}
+
+    assert asyncio.run(fetcher.fetch(URL)) == feed
+    assert len(parsed) == 1
+    # the validators of the last response are cached
+    assert FeedCache(tmp_path).load(URL)["etag"] == ""
+
+
+def test_broken_cache(tmp_path):
+    cache = FeedCache(tmp_path)
+    cache.save(URL, {"etag": '"v1"'})
+    cache._path(URL).write_text("{")
+    assert cache.load(URL) == {}
@@ -0,0 +1,57 @@
+import github
+import pytest
+from github import Github
+
+
+class Response:
+    status_code = 201
+
+    def __init__(self, data: dict) -> None:
+        self.data = data
+
+    def json(self) -> dict:
+        return self.data
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(github, "CACHE_DIR", tmp_path / "cache")
+    client = Github("owner/repo")
+    client.releases = {"audio": {"id": 1, "name": "audio", "assets": []}}
+    client.requests = []
+    asset_ids = iter(range(100, 200))
+
+    def request(method: str, url: str, **kwargs) -> Response:
+        client.requests.append(method)
+        if method == "POST":
+            return Response({"id": next(asset_ids), "name": kwargs["params"]["name"]})
+        return Response({})
+
+    monkeypatch.setattr(client, "request", request)
+    return client
+
+
+def test_skip_unchanged_upload(tmp_path, client):
+    path = tmp_path / "feed.xml"
+    path.write_text("<rss><lastBuildDate>1</lastBuildDate><item/></rss>")
+    client.upload_release(path, "audio")
+    path.write_text("<rss><lastBuildDate>2</lastBuildDate><item/></rss>")
+    client.upload_release(path, "audio")
+    assert client.requests == ["POST"]
+
+    path.write_text("<rss><lastBuildDate>3</lastBuildDate><item/><item/></rss>")
+    client.upload_release(path, "audio")
+    assert client.requests == ["POST", "DELETE", "POST"]
+
+
+def test_upload_replaced_asset(tmp_path, client):
+    """An asset replaced by someone else has a new id, so the manifest digest of our upload does not apply to it."""
+    path = tmp_path / "feed.xml"
+    path.write_text("<rss><item/></rss>")
+    client.upload_release(path, "audio")
+    client.releases["audio"]["assets"] = [{"id": 42, "name": "feed.xml"}]
+    client.upload_release(path, "audio")
+    assert client.requests == ["POST", "DELETE", "POST"]
@@ -0,0 +1,47 @@
+import time
+
+from deferred import DeferredEntries
+from index import ProcessedIndex, index_path
+from store import JsonStore
+
+
+def test_pending_with_deferred_rows(tmp_path):
+    store = JsonStore()
+    store.add({"vid": "old", "time": "Mon, 01 Jan 2024 00:00:00 +0000"})
+    store.add({"vid": "done", "time": "Tue, 02 Jan 2024 00:00:00 +0000"})
+    deferred = DeferredEntries(tmp_path / "feed-deferred.json")
+    deferred.defer("later", "is_upcoming")
+    deferred.entries["due"] = {"reason": "is_live", "attempts": 1, "next_retry": "Mon, 01 Jan 2024 00:00:00 +0000"}
+
+    path = index_path(tmp_path, "youtube")
+    index = ProcessedIndex(path)
+    assert not index.has_feed("feed")
+    index.update_feed("feed", store, deferred)
+    index.update_feed("other", JsonStore())
+    index.close()
+
+    index = ProcessedIndex(path, readonly=True)
+    assert index.has_feed("feed")
+    assert index.high_water_mark("feed") == ("done", 1704153600.0)
+    assert index.high_water_mark("other") is None
+    remote = ["done", "later", "due", "new"]
+    assert index.pending("feed", remote) == {"due", "new"}
+    assert index.pending("feed", remote, now=time.time() + 86400 * 2) == {"due", "later", "new"}
+    assert index.pending("other", remote) == set(remote)
+    assert index.pending("feed", []) == set()
+    index.close()
+
+
+def test_update_replaces_rows(tmp_path):
+    store = JsonStore()
+    store.add({"vid": "a"})
+    deferred = DeferredEntries(tmp_path / "feed-deferred.json")
+    deferred.defer("b", "is_live")
+    index = ProcessedIndex(index_path(tmp_path, "youtube"))
+    index.update_feed("feed", store, deferred)
+
+    store.remove(["a"])
+    deferred.resolve("b")
+    index.update_feed("feed", store, deferred)
+    assert index.pending("feed", ["a", "b"]) == {"a", "b"}
+    index.close()
@@ -0,0 +1,53 @@
+import base
+import pytest
+import store
+from base import PodSync
+from journal import Journal
+from store import JsonStore
+from utils import save_json
+
+TIME = "Mon, 06 May 2024 10:00:00 +0000"
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(base, "CACHE_DIR", tmp_path / "cache")
+    return tmp_path / "cache"
+
+
+def test_replay_skips_incomplete_line(tmp_path):
+    journal = Journal(tmp_path / "feed.jsonl")
+    journal.append({"type": "database", "record": {"vid": "a"}})
+    journal.append({"type": "database", "record": {"vid": "b"}})
+    with journal.path.open("a") as f:
+        f.write('{"type": "data')  # killed while writing
+    assert [x["record"]["vid"] for x in journal.replay()] == ["a", "b"]
+    journal.clear()
+    assert journal.replay() == []
+
+
+def test_recover_unsaved_changes(tmp_path, cache_dir, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("GITHUB_REPOSITORY", "owner/pods")
+    uploads = []
+    monkeypatch.setattr(base.gh, "upload_release", lambda path, release_name: uploads.append(release_name))
+    path = tmp_path / "feed.json"
+    save_json([{"vid": "old", "time": TIME}], path)
+
+    # a killed run buffered an entry without flushing it
+    journal = Journal(cache_dir / "journal" / "feed.jsonl")
+    item = {"title": "new", "enclosure": {"@url": "https://example.com/new.m4a", "@length": 1, "@type": "audio/x-m4a"}, "guid": "https://example.com/new"}
+    journal.append({"type": "database", "record": {"vid": "new", "time": TIME}})
+    journal.append({"type": "rss", "pod_type": "audio", "items": [item], "feed": {"title": "feed", "link": "https://example.com"}})
+
+    pod = PodSync("feed", {"name": "feed", "cover": "https://example.com/cover.jpg"}, path)
+    assert pod.is_processed("new")
+    assert uploads == []
+
+    pod.flush()
+    assert uploads == ["audio", "metadata"]  # RSS feeds before the database
+    assert "new" in JsonStore(path)
+    assert "https://example.com/new" in (tmp_path / "audio" / "feed.xml").read_text()
+    assert not journal.path.exists()
+    pod.store.close()
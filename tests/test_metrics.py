@@ -0,0 +1,27 @@
+import pytest
+from metrics import NULL_SPAN, Metrics
+
+
+def test_span_records_counts_and_errors():
+    metrics = Metrics()
+    metrics.enabled = True
+    with metrics.span("upload", "feed") as span:
+        span.add(bytes=10, error=1)  # a count can have any name
+    with pytest.raises(KeyError), metrics.span("upload", "feed"):
+        raise KeyError
+    metrics.count("upload", "feed", skipped=1)
+
+    stats = metrics.stats[("upload", "feed")]
+    assert stats["calls"] == 2
+    assert stats["errors"] == 1
+    assert stats["error"] == 1
+    assert stats["bytes"] == 10
+    assert stats["skipped"] == 1
+    assert metrics.report()["stages"]["upload"]["feeds"]["feed"]["calls"] == 2
+
+
+def test_disabled_metrics():
+    metrics = Metrics()
+    assert metrics.span("upload") is NULL_SPAN
+    metrics.count("upload", bytes=1)
+    assert metrics.stats == {}
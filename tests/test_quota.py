@@ -0,0 +1,82 @@
+import pytest
+import quota
+from quota import QuotaPlan, parse_size
+from store import JsonStore
+from utils import save_xml
+
+RELEASE = "https://github.com/owner/pods/releases/download/feed"
+
+
+def make_store(*records: tuple[str, str]) -> JsonStore:
+    store = JsonStore()
+    for vid, time in records:
+        store.add({"vid": vid, "time": time})
+    return store
+
+
+@pytest.fixture
+def releases(monkeypatch):
+    assets = [
+        {"name": "a.m4a", "id": 1, "size": 100},
+        {"name": "b.m4a", "id": 2, "size": 300},
+        {"name": "b-P2.m4a", "id": 3, "size": 300},
+        {"name": "c.m4a", "id": 4, "size": 200},
+        {"name": "feed.xml", "id": 5, "size": 10},
+    ]
+    monkeypatch.setattr(quota.gh, "get_releases", lambda: {"feed": {"assets": assets}})
+    return assets
+
+
+@pytest.fixture
+def store():
+    # added from the oldest to the newest
+    return make_store(("a", "Mon, 01 Jan 2024 00:00:00 +0000"), ("b", "Tue, 02 Jan 2024 00:00:00 +0000"), ("c", "Wed, 03 Jan 2024 00:00:00 +0000"))
+
+
+def test_parse_size():
+    assert parse_size("500M") == 500 * 1024**2
+    assert parse_size("1.5 GiB") == int(1.5 * 1024**3)
+    with pytest.raises(ValueError, match="Invalid size"):
+        parse_size("lots")
+
+
+def test_oldest_policy(releases, store):
+    plan = QuotaPlan({"feed": store}, 800, min_keep={})
+    assert plan.evict == {"feed": {"a", "b"}}
+    assert plan.freed == 700
+    assert sorted(plan.assets["feed"]["b"]) == [2, 3]
+
+
+def test_largest_policy(releases, store):
+    plan = QuotaPlan({"feed": store}, 800, min_keep={}, policy="largest")
+    assert plan.evict == {"feed": {"b"}}
+    assert plan.freed == 600
+
+
+def test_min_keep(releases, store):
+    plan = QuotaPlan({"feed": store}, 0, min_keep={"feed": 2})
+    assert plan.evict == {"feed": {"a"}}
+
+
+def test_unknown_policy(releases, store):
+    with pytest.raises(ValueError, match="Unknown eviction policy"):
+        QuotaPlan({"feed": store}, 0, min_keep={}, policy="newest")
+
+
+def test_apply_refuses_missing_rss(tmp_path, monkeypatch, releases, store):
+    monkeypatch.chdir(tmp_path)
+    deleted = []
+    monkeypatch.setattr(quota.gh, "upload_release", lambda path, release_name: None)
+    monkeypatch.setattr(quota.gh, "delete_asset", deleted.append)
+    item = {"title": "c", "enclosure": {"@url": f"{RELEASE}/c.m4a", "@length": 1, "@type": "audio/x-m4a"}, "guid": "https://www.youtube.com/watch?v=c"}
+    save_xml({"rss": {"channel": {"title": "feed"}}}, [item], tmp_path / "audio" / "feed.xml")
+    plan = QuotaPlan({"feed": store}, 800, min_keep={})
+
+    with pytest.raises(RuntimeError, match="video/feed.xml"):
+        plan.apply({"feed": store}, tmp_path)
+    assert deleted == []
+    assert not (tmp_path / "feed.json").exists()
+
+    plan.apply({"feed": store}, tmp_path, pod_types={"feed": ("audio",)})
+    assert sorted(deleted) == [1, 2, 3]
+    assert store.get("a")["evicted"]
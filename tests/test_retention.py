@@ -0,0 +1,87 @@
+import pytest
+import retention
+from retention import RetentionPlan, asset_to_vid, guid_to_vid
+from store import JsonStore
+from utils import save_xml, trim_xml
+
+RELEASE = "https://github.com/owner/pods/releases/download/feed"
+
+
+def make_item(title: str, guid: str, asset: str) -> dict:
+    return {"title": title, "enclosure": {"@url": f"{RELEASE}/{asset}", "@length": 1, "@type": "audio/x-m4a"}, "guid": guid}
+
+
+def test_guid_to_vid():
+    assert guid_to_vid("https://www.youtube.com/watch?v=abc") == "abc"
+    assert guid_to_vid("https://www.youtube.com/watch?v=abc#P2") == "abc"
+    assert guid_to_vid("https://www.bilibili.com/video/BV1xx#P3") == "BV1xx"
+
+
+def test_asset_to_vid():
+    assert asset_to_vid("abc.m4a") == "abc"
+    assert asset_to_vid("abc-P2.mp4") == "abc"
+    assert asset_to_vid("feed.xml") is None
+
+
+def test_trim_keeps_all_parts_of_kept_entries(tmp_path):
+    """Legacy split videos share one guid per part, and all parts of a kept entry stay in the feed."""
+    kept, expired = "https://www.youtube.com/watch?v=kept", "https://www.youtube.com/watch?v=expired"
+    items = [make_item(f"kept{n}", kept, "kept.m4a" if n == 1 else f"kept-P{n}.m4a") for n in (1, 2, 3)]
+    items += [make_item(f"expired{n}", expired, "expired.m4a" if n == 1 else f"expired-P{n}.m4a") for n in (1, 2)]
+    path = tmp_path / "feed.xml"
+    save_xml({"rss": {"channel": {"title": "feed"}}}, items, path)
+
+    def accept(guid: str) -> bool:
+        return guid_to_vid(guid) == "kept"
+
+    assert trim_xml(path, accept=accept, dry_run=True) == 2
+    assert trim_xml(path, accept=accept) == 2
+    assert path.read_text().count("<item>") == 3
+
+
+def make_store(vids: list[str]) -> JsonStore:
+    store = JsonStore()
+    for vid in vids:
+        store.add({"vid": vid, "title": vid})
+    return store
+
+
+def write_feed(vids: list[str], pod_type: str = "audio") -> None:
+    items = [make_item(vid, f"https://www.youtube.com/watch?v={vid}", f"{vid}.m4a") for vid in vids]
+    save_xml({"rss": {"channel": {"title": "feed"}}}, items, f"{pod_type}/feed.xml")
+
+
+def patch_assets(monkeypatch, names: list[str], updated_at: str = "2020-01-01T00:00:00Z") -> None:
+    assets = {name: {"id": idx, "size": 1, "updated_at": updated_at} for idx, name in enumerate(names)}
+    monkeypatch.setattr(retention.gh, "get_release_assets", lambda name: assets)
+
+
+def test_asset_to_vid_prefers_known_vids():
+    assert asset_to_vid("abc-P12.m4a") == "abc"
+    assert asset_to_vid("abc-P12.m4a", {"abc-P12"}) == "abc-P12"
+    assert asset_to_vid("abc-P12-P2.m4a", {"abc-P12"}) == "abc-P12"
+
+
+def test_refuse_empty_metadata(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_feed(["a", "b"])
+    patch_assets(monkeypatch, ["a.m4a", "b.m4a"])
+    with pytest.raises(RuntimeError):
+        RetentionPlan("feed", make_store([]), keep=1)
+
+
+def test_refuse_truncated_metadata(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_feed([f"v{n}" for n in range(10)])
+    patch_assets(monkeypatch, [])
+    with pytest.raises(RuntimeError):
+        RetentionPlan("feed", make_store(["v0", "v1"]), keep=1)
+
+
+def test_orphans_need_flag(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_feed(["a", "b"])
+    patch_assets(monkeypatch, ["a.m4a", "b.m4a", "orphan.m4a"])
+    store = make_store(["a", "b"])
+    assert set(RetentionPlan("feed", store, keep=1).drop_assets) == {"a.m4a"}
+    assert set(RetentionPlan("feed", store, keep=1, delete_orphans=True).drop_assets) == {"a.m4a", "orphan.m4a"}
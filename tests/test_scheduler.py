@@ -0,0 +1,46 @@
+import scheduler
+
+
+def feed(name: str, backlog: int, platform: str = "youtube") -> dict:
+    return {"platform": platform, "name": name, "backlog": backlog, "oldest": 0.0}
+
+
+def run(title: str, status: str) -> dict:
+    return {"display_title": title, "status": status}
+
+
+def patch_runs(monkeypatch, runs: list[dict]) -> list[tuple[str, str]]:
+    triggered = []
+    monkeypatch.setattr(scheduler.gh, "get_active_runs", lambda workflow: runs)
+    monkeypatch.setattr(scheduler.gh, "trigger_workflow", lambda names, platform: triggered.append((platform, names)))
+    return triggered
+
+
+def test_one_run_per_platform_by_backlog(monkeypatch):
+    triggered = patch_runs(monkeypatch, [])
+    counts = scheduler.dispatch([feed("a", 1), feed("b", 5), feed("c", 2, "bilibili")])
+    assert triggered == [("youtube", "b,a"), ("bilibili", "c")]
+    assert counts["dispatched"] == 2
+    assert counts["coalesced"] == 1
+
+
+def test_skip_only_in_progress(monkeypatch):
+    triggered = patch_runs(monkeypatch, [run("youtube a", "in_progress")])
+    counts = scheduler.dispatch([feed("a", 1), feed("b", 1)])
+    assert triggered == [("youtube", "b")]
+    assert counts["skipped"] == 1
+
+
+def test_merge_queued_run(monkeypatch):
+    """A new dispatch cancels the queued run of the platform, so its feeds are dispatched again."""
+    triggered = patch_runs(monkeypatch, [run("youtube x,a", "queued")])
+    counts = scheduler.dispatch([feed("a", 1), feed("b", 3)])
+    assert triggered == [("youtube", "b,a,x")]
+    assert counts["merged"] == 1
+
+
+def test_leave_feeds_to_queued_run(monkeypatch):
+    triggered = patch_runs(monkeypatch, [run("youtube a,b", "queued")])
+    counts = scheduler.dispatch([feed("a", 1)])
+    assert triggered == []
+    assert counts["skipped"] == 1
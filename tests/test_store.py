@@ -0,0 +1,86 @@
+import os
+
+import base
+import pytest
+import store
+from base import PodSync
+from store import JsonStore, SQLiteStore, open_store
+from utils import save_json
+
+RECORDS = [
+    {"vid": "new", "time": "Tue, 02 Jan 2024 00:00:00 +0000"},
+    {"vid": "old", "time": "Mon, 01 Jan 2024 00:00:00 +0000"},
+]
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(base, "CACHE_DIR", tmp_path / "cache")
+    return tmp_path / "cache"
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_round_trip(tmp_path, cache_dir, backend):
+    path = tmp_path / "feed.json"
+    save_json(RECORDS, path)
+    metadata = open_store(path, backend)
+    assert len(metadata) == 2
+    assert [x["vid"] for x in metadata.newest()] == ["new", "old"]
+
+    metadata.add({"vid": "newest", "time": "Wed, 03 Jan 2024 00:00:00 +0000"})
+    metadata.export_json(path)
+    metadata.close()
+    assert [x["vid"] for x in JsonStore(path).newest()] == ["newest", "new", "old"]
+
+
+def test_sqlite_reimports_changed_json(tmp_path, cache_dir):
+    path = tmp_path / "feed.json"
+    save_json(RECORDS, path)
+    metadata = open_store(path)
+    assert isinstance(metadata, SQLiteStore)
+    assert metadata.is_synced(path)
+    metadata.close()
+
+    # Someone else published a new version of the json, e.g. a run of another machine.
+    save_json(RECORDS[1:], path)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    metadata = open_store(path)
+    assert [x["vid"] for x in metadata] == ["old"]
+    metadata.close()
+
+
+def test_add_does_not_write_json(tmp_path, cache_dir):
+    path = tmp_path / "feed.json"
+    save_json(RECORDS, path)
+    metadata = open_store(path)
+    before = path.stat().st_mtime_ns
+    metadata.add({"vid": "newest", "time": "Wed, 03 Jan 2024 00:00:00 +0000"})
+    assert path.stat().st_mtime_ns == before
+    assert "newest" not in JsonStore(path)
+    metadata.close()
+
+
+def test_unknown_store(tmp_path):
+    with pytest.raises(ValueError, match="Unknown metadata store"):
+        open_store(tmp_path / "feed.json", "csv")
+
+
+def test_database_is_exported_at_flush(tmp_path, cache_dir, monkeypatch):
+    uploads = []
+    monkeypatch.setattr(base.gh, "upload_release", lambda path, release_name: uploads.append(release_name))
+    path = tmp_path / "feed.json"
+    save_json(RECORDS, path)
+    pod = PodSync("feed", {}, path, checkpoint_entries=3)
+    for vid in ("a", "b"):
+        pod.update_database({"need_update_database": True, "metadata": {"vid": vid, "time": RECORDS[0]["time"]}})
+        pod.checkpoint()
+    assert uploads == []
+    assert len(JsonStore(path)) == 2
+
+    pod.update_database({"need_update_database": True, "metadata": {"vid": "c", "time": RECORDS[0]["time"]}})
+    pod.checkpoint()
+    assert uploads == ["metadata"]
+    assert len(JsonStore(path)) == 5
+    pod.store.close()
@@ -0,0 +1,45 @@
+from utils import save_xml, splice_xml, trim_xml
+
+RELEASE = "https://github.com/owner/pods/releases/download/feed"
+
+
+def make_item(title: str, guid: str, asset: str) -> dict:
+    return {"title": title, "enclosure": {"@url": f"{RELEASE}/{asset}", "@length": 1, "@type": "audio/x-m4a"}, "guid": guid}
+
+
+def make_header() -> dict:
+    return {"rss": {"@version": "2.0", "channel": {"title": "feed", "item": []}}}
+
+
+def read_titles(path) -> list[str]:
+    import xmltodict
+
+    items = xmltodict.parse(path.read_text(), force_list=("item",))["rss"]["channel"].get("item", [])
+    return [x["title"] for x in items]
+
+
+def legacy_feed(tmp_path):
+    """A feed written before split videos had their own guids: every part has the link of the video as guid."""
+    link = "https://www.youtube.com/watch?v=old"
+    path = tmp_path / "feed.xml"
+    save_xml(make_header(), [make_item(f"part{n}", link, "old.m4a" if n == 1 else f"old-P{n}.m4a") for n in (1, 2, 3)], path)
+    return path
+
+
+def test_splice_keeps_legacy_parts(tmp_path):
+    path = legacy_feed(tmp_path)
+    splice_xml(make_header(), [make_item("new", "https://www.youtube.com/watch?v=new", "new.m4a")], path)
+    assert read_titles(path) == ["new", "part1", "part2", "part3"]
+
+
+def test_splice_replaces_same_item(tmp_path):
+    path = legacy_feed(tmp_path)
+    splice_xml(make_header(), [make_item("part2 again", "https://www.youtube.com/watch?v=old", "old-P2.m4a")], path)
+    assert read_titles(path) == ["part2 again", "part1", "part3"]
+
+
+def test_trim_keeps_legacy_parts(tmp_path):
+    path = legacy_feed(tmp_path)
+    assert trim_xml(path, accept=lambda guid: True) == 0
+    assert trim_xml(path, keep=2) == 1
+    assert read_titles(path) == ["part1", "part2"]